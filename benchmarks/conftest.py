@@ -0,0 +1,12 @@
+def pytest_addoption(parser):
+    parser.addoption('--bench-languages', default='V6L3s0',
+                     help="Comma separated names of the languages to benchmark (default: %(default)s).")
+    parser.addoption('--bench-overgeneration', type=int, default=100,
+                     help="Number of samples for the overgeneration coverage benchmark.")
+    parser.addoption('--bench-import-budgets', action='store_true',
+                     help="Fail the import time benchmarks of the scripts over their budget (IMPORT_BUDGETS).")
+
+def pytest_generate_tests(metafunc):
+    if 'language' in metafunc.fixturenames:
+        languages = metafunc.config.getoption('--bench-languages').split(',')
+        metafunc.parametrize('language', languages, scope='module')
@@ -0,0 +1,82 @@
+import random
+import zlib
+from collections import Counter, defaultdict
+
+'''
+Synthetic stand-ins for the outputs of the external binaries (CCL and BMM),
+such that the Python stages of the pipeline can be benchmarked on any
+language without running cclparser or BMM.jar.
+The fixtures are derived deterministically (given the seed) from the messages:
+each message gets a random binary bracketing in the CCL output format,
+and a BMM grammar is read off these bracketings by labelling each
+constituent by the labels of its children.
+'''
+
+def random_bracketing(tokens, rng):
+    ''' Returns a random binary bracketing of the tokens as (nested) tuples '''
+    if len(tokens) == 1:
+        return tokens[0]
+    k = rng.randint(1, len(tokens)-1)
+    return (random_bracketing(tokens[:k], rng), random_bracketing(tokens[k:], rng))
+
+def to_ccl(tree):
+    ''' Formats a bracketing like the CCL parser output '''
+    if isinstance(tree, str):
+        return tree
+    return "(" + " ".join(to_ccl(t) for t in tree) + ")"
+
+def ccl_output(messages, seed=0):
+    ''' Returns the text of a CCL bracket file for the messages and the bracketings '''
+    rng = random.Random(seed)
+    trees = [random_bracketing(list(m), rng) for m in messages if m]
+    text = "\n".join(to_ccl(t) if isinstance(t, tuple) else f"({t})" for t in trees)
+    return text, trees
+
+def bmm_output(trees, seed=0, word_classes=None, labels=20, flatten=0.3):
+    ''' Returns the text of a BMM Induced_Grammar.txt for the bracketings.
+    Terminals are assigned to (at most two) word classes, each constituent
+    is labelled by hashing the labels of its children and a fraction of the
+    constituents is flattened into its parent to give longer rules. '''
+    rng = random.Random(seed)
+    vocab = sorted({w for t in trees for w in _leaves(t)})
+    word_classes = word_classes or max(2, len(vocab)//2)
+    classes = {w: [f"PT{i % word_classes}"] + ([f"PT{(3*i+1) % word_classes}"] if rng.random() < 0.3 else [])
+               for i, w in enumerate(vocab)}
+    rules = defaultdict(Counter)
+
+    def label(tree, top=False):
+        if isinstance(tree, str):
+            return rng.choice(classes[tree])
+        children = []
+        for t in tree:
+            if not isinstance(t, str) and rng.random() < flatten:
+                children += [label(c) for c in t] # flatten child into this constituent
+            else:
+                children.append(label(t))
+        lhs = "TOP" if top else f"NT{zlib.crc32(' '.join(children).encode()) % labels}"
+        rules[lhs][tuple(children)] += 1
+        return lhs
+
+    for tree in trees:
+        if isinstance(tree, str):
+            rules["TOP"][(rng.choice(classes[tree]),)] += 1
+        else:
+            label(tree, top=True)
+    for w, cs in classes.items():
+        for c in cs:
+            rules[c][(w,)] += 1
+
+    lines = ["BMM induced grammar", "NONTERMINALS", "TOP"]
+    lines += sorted(nt for nt in rules if nt != "TOP")
+    lines.append("PRODUCTION RULES")
+    for lhs, rhss in rules.items():
+        lines.append(f"RULESOFNONTERMINAL {lhs}")
+        total = sum(rhss.values())
+        for rhs, count in rhss.items():
+            lines.append("*".join(rhs) + f"*#{count/total}")
+    return "\n".join(lines)
+
+def _leaves(tree):
+    if isinstance(tree, str):
+        return [tree]
+    return [w for t in tree for w in _leaves(t)]
@@ -0,0 +1,299 @@
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO / "utils"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from nltk import PCFG, Nonterminal
+import analysis
+import bmm_labels2grammar
+import convert2constituents
+import fixtures
+import instrument
+
+'''
+Benchmarks each Python stage of the grammar induction pipeline on a set of
+the languages in data/simple-referential-game/ and writes the timings,
+throughput and peak memory of each stage (see PipelineBenchmark.peak_memory_kb)
+to a JSON file.
+The outputs of CCL and BMM are replaced by synthetic fixtures (see fixtures.py).
+Besides, the time to import the module of each command line script in a fresh
+interpreter is measured and checked against its budget (IMPORT_BUDGETS).
+
+Example usage:
+    python benchmarks/run_benchmarks.py --languages V6L3s0 V13L10s0 --output bench.json
+    python benchmarks/run_benchmarks.py --languages V6L3s0 --baseline bench.json
+'''
+
+STAGES = ['load_messages', 'convert2constituents', 'parse_induced_grammar', 'pcfg_fromstring',
+          'analyse_grammar', 'analyse_viterbi', 'overgeneration_coverage']
+
+# Maximum time in seconds to import the module of each script in utils/ (startup of the script).
+# The light scripts only import NLTK and/or numpy on the code paths that need them.
+IMPORT_BUDGETS = {
+    'bmm_labels2grammar': 0.1,
+    'convert2constituents': 0.1,
+    'baselines': 0.1,
+    'bmm_update': 0.1,
+    'glove': 0.25,
+    'tree_stats': 0.25,
+    'analysis': 0.75,
+    'sampler': 0.75,
+    'compare_grammars': 0.75,
+    'induce': 1.0,
+}
+
+
+class PipelineBenchmark:
+    ''' The stages of the pipeline for one language.
+    Each stage returns the number of items it processed and the unit of these items;
+    its inputs are prepared (untimed) on first use. '''
+
+    def __init__(self, language, data_dir, work_dir, overgeneration=100, seed=0):
+        self.language = language
+        self.data_dir = Path(data_dir)
+        self.work_dir = Path(work_dir)
+        self.overgeneration = overgeneration
+        self.seed = seed
+        self.L = int(re.search(r'L(\d+)', language).group(1))
+
+        # Languages (e.g. V6L3s0) have an induction and evaluation set, baselines (e.g. V6L3_rand) only one file
+        induct = self.data_dir / f"{language}_orig.txt"
+        self.induct = induct if induct.exists() else self.data_dir / f"{language}.txt"
+        evaluation = self.data_dir / f"{language}_eval.txt"
+        self.eval = evaluation if evaluation.exists() else self.induct
+        if not self.induct.exists():
+            raise FileNotFoundError(f"No messages found for language {language} in {self.data_dir}")
+
+        self._messages = None
+        self._bracket_file = None
+        self._bmm_file = None
+        self._grammar_string = None
+        self._pcfg = None
+
+    @property
+    def messages(self):
+        if self._messages is None:
+            self._messages = analysis.load_messages(self.induct)
+        return self._messages
+
+    @property
+    def bracket_file(self):
+        if self._bracket_file is None:
+            text, self._trees = fixtures.ccl_output(self.messages, self.seed)
+            self._bracket_file = self.work_dir / f"{self.language}.ccl"
+            self._bracket_file.write_text(text)
+        return self._bracket_file
+
+    @property
+    def bmm_file(self):
+        if self._bmm_file is None:
+            self.bracket_file
+            self._bmm_file = self.work_dir / f"{self.language}_Induced_Grammar.txt"
+            self._bmm_file.write_text(fixtures.bmm_output(self._trees, self.seed))
+        return self._bmm_file
+
+    @property
+    def grammar_string(self):
+        if self._grammar_string is None:
+            self._grammar_string = bmm_labels2grammar.parse_induced_grammar(self.bmm_file)
+        return self._grammar_string
+
+    @property
+    def pcfg(self):
+        if self._pcfg is None:
+            self._pcfg = PCFG.fromstring(self.grammar_string)
+            self._pcfg._start = Nonterminal('TOP')
+        return self._pcfg
+
+    def load_messages(self):
+        messages = analysis.load_messages(self.induct)
+        return len(messages), 'messages'
+
+    def convert2constituents(self):
+        output = self.work_dir / f"{self.language}_bmm"
+        # convert2constituents appends to its output files
+        for ext in ['.txt', '.span']:
+            if output.with_suffix(ext).exists():
+                output.with_suffix(ext).unlink()
+        config = argparse.Namespace(bracket_file=self.bracket_file, format='ccl', shapes=False, output=output)
+        convert2constituents.main(config)
+        return len(self.messages), 'messages'
+
+    def parse_induced_grammar(self):
+        grammar_string = bmm_labels2grammar.parse_induced_grammar(self.bmm_file)
+        return grammar_string.count('\n') + 1, 'nonterminals'
+
+    def pcfg_fromstring(self):
+        pcfg = PCFG.fromstring(self.grammar_string)
+        return len(pcfg.productions()), 'rules'
+
+    def analyse_grammar(self):
+        analysis.analyse_grammar(self.pcfg)
+        return len(self.pcfg.productions()), 'rules'
+
+    def analyse_viterbi(self):
+        messages = analysis.load_messages(self.eval)
+        analysis.analyse_viterbi(self.pcfg, messages)
+        return len(messages), 'messages'
+
+    def overgeneration_coverage(self):
+        analysis.overgeneration_coverage(self.pcfg, self.L, self.overgeneration)
+        return self.overgeneration, 'messages'
+
+    def prepare(self, stage):
+        ''' Prepares the (untimed) inputs of a stage '''
+        if stage == 'convert2constituents':
+            self.bracket_file
+        elif stage == 'parse_induced_grammar':
+            self.bmm_file
+        elif stage == 'pcfg_fromstring':
+            self.grammar_string
+        elif stage in ['analyse_grammar', 'analyse_viterbi', 'overgeneration_coverage']:
+            self.pcfg
+
+    def peak_memory_kb(self, stage):
+        ''' Returns the peak memory (in kB) allocated by one (untimed) run of the stage, traced with tracemalloc
+        (which includes numpy arrays). Unlike the peak RSS of the process, which runs all stages, this does
+        not include the memory of the earlier stages or of the prepared inputs '''
+        self.prepare(stage)
+        tracemalloc.start()
+        try:
+            getattr(self, stage)()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak // 1024
+
+    def run(self, stage, repeat=1):
+        ''' Runs a stage repeat times and returns its best time, throughput and peak memory '''
+        self.prepare(stage)
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            items, unit = getattr(self, stage)()
+            seconds.append(time.perf_counter() - start)
+        best = min(seconds)
+        return {
+            'seconds': best,
+            'items': items,
+            'unit': unit,
+            'per_second': items / best if best > 0 else float('inf'),
+            'peak_memory_kb': self.peak_memory_kb(stage),
+        }
+
+
+def import_time(module, repeat=3):
+    ''' Returns the fastest of repeat times (in seconds) to import a module of utils/ in a new interpreter '''
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    times = [float(subprocess.check_output([sys.executable, '-c', code], cwd=REPO / "utils")) for _ in range(repeat)]
+    return min(times)
+
+def check_imports(repeat=3):
+    ''' Returns the import time and budget of each script and prints the scripts over budget '''
+    results = {}
+    for module, budget in IMPORT_BUDGETS.items():
+        seconds = import_time(module, repeat)
+        results[module] = {'seconds': seconds, 'budget': budget}
+        flag = "  OVER BUDGET" if seconds > budget else ""
+        print(f"{'import':>12} {module:>24} {seconds:10.4f}s (budget {budget:.2f}s){flag}")
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance):
+    ''' Prints the stages that are more than tolerance (fraction) slower than in the baseline.
+    Returns the number of regressions '''
+    regressions = 0
+    for language, stages in results['languages'].items():
+        for stage, r in stages.items():
+            old = baseline.get('languages', {}).get(language, {}).get(stage)
+            if not old:
+                continue
+            ratio = r['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+            flag = ""
+            if ratio > 1 + tolerance:
+                regressions += 1
+                flag = "  REGRESSION"
+            print(f"{language:>12} {stage:>24} {old['seconds']:10.4f}s -> {r['seconds']:10.4f}s ({ratio:.2f}x){flag}")
+    return regressions
+
+def main(args):
+    stages = args.stages or STAGES
+    results = {
+        'date': datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'languages': {},
+    }
+    if not args.skip_imports:
+        results['imports'] = check_imports(max(args.repeat, 3))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for language in args.languages:
+            bench = PipelineBenchmark(language, args.data_dir, work_dir, args.overgeneration, args.seed)
+            results['languages'][language] = {}
+            for stage in stages:
+                r = bench.run(stage, args.repeat)
+                results['languages'][language][stage] = r
+                print(f"{language:>12} {stage:>24} {r['seconds']:10.4f}s {r['per_second']:12.1f} {r['unit']}/s "
+                      f"{r['peak_memory_kb']/1024:8.1f} MB peak memory")
+    results['peak_rss_kb'] = instrument.peak_rss_kb()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    over_budget = [m for m, r in results.get('imports', {}).items() if r['seconds'] > r['budget']]
+    if over_budget:
+        print(f"\nImports over budget: {', '.join(over_budget)}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {args.baseline} (revision {baseline.get('revision')}):")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    if over_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the stages of the grammar induction pipeline.')
+    parser.add_argument('--languages', nargs='+', default=['V6L3s0', 'V13L5s0', 'V27L10s0'],
+                        help="Names of the languages (e.g. V13L10s0 or V13L10_rand) to benchmark.")
+    parser.add_argument('--data_dir', type=str, default=str(REPO / 'data' / 'simple-referential-game'),
+                        help="Directory with the message files of the languages.")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=None,
+                        help="Stages to benchmark (default: all).")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Number of runs of each stage; the fastest run is reported.")
+    parser.add_argument('--overgeneration', type=int, default=100,
+                        help="Number of samples for the overgeneration coverage.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for the synthetic CCL and BMM fixtures.")
+    parser.add_argument('--skip_imports', action='store_true',
+                        help="Do not measure the import times of the scripts.")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Path to the JSON file for the results.")
+    parser.add_argument('--baseline', type=str, default=None,
+                        help="JSON file of an earlier run to compare with; exits with 1 on a regression.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Fraction a stage may be slower than in the baseline before it counts as a regression.")
+    args = parser.parse_args()
+    main(args)
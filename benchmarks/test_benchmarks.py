@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import run_benchmarks
+from run_benchmarks import PipelineBenchmark, STAGES, REPO, IMPORT_BUDGETS
+
+'''
+pytest-benchmark versions of the pipeline benchmarks, run with e.g.
+    pytest benchmarks/ --bench-languages=V6L3s0,V13L10s0 --benchmark-json=bench.json
+'''
+
+@pytest.fixture(scope='module')
+def pipeline(language, request, tmp_path_factory):
+    return PipelineBenchmark(language, REPO / 'data' / 'simple-referential-game',
+                             tmp_path_factory.mktemp(language),
+                             overgeneration=request.config.getoption('--bench-overgeneration'))
+
+@pytest.mark.parametrize('stage', STAGES)
+def test_stage(benchmark, pipeline, stage):
+    pipeline.prepare(stage)
+    benchmark.extra_info['language'] = pipeline.language
+    items, unit = benchmark(getattr(pipeline, stage))
+    benchmark.extra_info['items'] = items
+    benchmark.extra_info['unit'] = unit
+    benchmark.extra_info['peak_memory_kb'] = pipeline.peak_memory_kb(stage)
+
+@pytest.mark.parametrize('module', IMPORT_BUDGETS)
+def test_import_time(benchmark, module, request):
+    # Each round imports the module in a new interpreter; the import itself is timed inside it
+    times = []
+    benchmark.pedantic(lambda: times.append(run_benchmarks.import_time(module, repeat=1)), rounds=3, iterations=1)
+    benchmark.extra_info['import_s'] = min(times)
+    benchmark.extra_info['budget_s'] = IMPORT_BUDGETS[module]
+    # Wall-clock budgets depend on the machine, so they are only checked on request
+    if request.config.getoption('--bench-import-budgets'):
+        assert min(times) <= IMPORT_BUDGETS[module]
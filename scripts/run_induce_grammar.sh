@@ -30,6 +30,20 @@
 #                     example: -L=10
 # --overgen_num    -  (optional) number of random samples for estimating the overgeneration coverage
 #                     example: --overgen_num=10 -L=10
+# --beam_width     -  (optional) approximate the Viterbi parses in the analysis with this beam width per chart cell
+#                     example: --beam_width=20
+# --beam_threshold -  (optional) approximate the Viterbi parses in the analysis with this log2 probability threshold
+#                     example: --beam_threshold=10
+# --profile        -  (optional) profile the Viterbi parsing in the analysis with cprofile or pyinstrument
+#                     example: --profile=cprofile
+# --block_size     -  (optional) read and parse the messages in the analysis in blocks of this size to bound the memory use
+#                     example: --block_size=100000
+# --parse_store    -  (optional) save the Viterbi parses of the analysis in compact arrays (.parses.npz) in the log directory
+#                     example: --parse_store
+# --cpu            -  (optional) run DIORA on the CPU instead of the GPU(s) (not yet verified with DIORA)
+#                     example: --cpu
+# --threads        -  (optional) number of threads for DIORA on the CPU (default: all cores)
+#                     example: --cpu --threads=8
 #
 # BEHAVIOUR
 # ---------
@@ -56,6 +70,12 @@ SETSIZE=false
 LANGUAGE_DIR=false
 LOGDIR=logs/"$(date +"%d-%m-%Y__%H-%M-%S")"
 NUM_OVERGENERATION_SAMPLES=0 # number of random message samples for overgeneration coverage
+BEAM_FLAGS="" # beam pruning of the Viterbi parses in the analysis
+PROFILE_FLAGS="" # profiling of the Viterbi parses in the analysis
+BLOCK_FLAGS="" # parsing the messages in blocks in the analysis
+STORE_FLAGS="" # saving the parses of the analysis
+DIORA_CPU=false # train and parse with DIORA on the CPU
+NUM_THREADS=$(nproc) # number of threads for DIORA on the CPU
 DATADIR='data'
 
 # Read flags
@@ -83,6 +103,27 @@ do
     --overgen_num=*)
         NUM_OVERGENERATION_SAMPLES="${i#*=}"
         ;;
+    --beam_width=*)
+        BEAM_FLAGS="$BEAM_FLAGS --beam_width ${i#*=}"
+        ;;
+    --beam_threshold=*)
+        BEAM_FLAGS="$BEAM_FLAGS --beam_threshold ${i#*=}"
+        ;;
+    --profile=*)
+        PROFILE_FLAGS="--profile ${i#*=}"
+        ;;
+    --block_size=*)
+        BLOCK_FLAGS="--block_size ${i#*=}"
+        ;;
+    --parse_store)
+        STORE_FLAGS="--parse_store"
+        ;;
+    --cpu)
+        DIORA_CPU=true
+        ;;
+    --threads=*)
+        NUM_THREADS="${i#*=}"
+        ;;
 	-V=*)
 	    VOCAB_SIZE="${i#*=}"
 	    ;;
@@ -124,7 +165,8 @@ fi
 # Run Glove to get word embedding vectors
 function glove {
     mkdir -p results/glove
-    bash scripts/run_glove.sh --corpus="$DATADIR/$1.txt" --glove="pipeline/glove" --output="results/glove" --name=$1 > $LOGDIR/glove.log #| tee $LOG_DIR/"$INPUT"_glove.log
+    # The vectors are trained in NumPy; scripts/run_glove.sh runs the original GloVe binaries instead
+    python utils/glove.py --corpus "$DATADIR/$1.txt" --output results/glove --name $1 > $LOGDIR/glove.log
 }
 
 # Run CCL parser
@@ -142,7 +184,7 @@ function ccl {
     cat pipeline/ccl/corpus.txt | awk '{print $0" ."}' > "results/bmm/$1.txt"
     
     # Convert constituents to BMM readable format
-    python utils/convert2constituents.py --bracket_file results/ccl/$1.ccl --format ccl --shapes True --output "results/bmm/$1"
+    python utils/convert2constituents.py --bracket_file results/ccl/$1.ccl --format ccl --shapes True --output "results/bmm/$1" --log_dir $LOGDIR
 }
 
 # Run DIORA parser
@@ -154,22 +196,32 @@ function diora {
     DIORA_DIR_DIORA=$PWD/pipeline/diora
     CORPUS_DIORA=$PWD/pipeline/ccl/corpus.txt
     NUM_MESSAGES=$(cat $CORPUS_DIORA | wc -l)
-    # Take the minimum value to make sure batch_size is not larger than the whole message set
-    BATCH_SIZE=$(( $NUM_MESSAGES < 128 ? $NUM_MESSAGES : 128 ))
     EPOCHS=5
-    CUDA="--cuda --multigpu" # set "--cuda" if using CUDA and "" if not
-    LOG_DIORA=$PWD/$LOG_DIR/$1_diora.log
+    if [[ $DIORA_CPU == true ]]; then
+        # Larger batches, and all cores for the matrix operations (set in the subshell below)
+        BATCH_SIZE=$(( $NUM_MESSAGES < 1024 ? $NUM_MESSAGES : 1024 ))
+        CUDA=""
+    else
+        # Take the minimum value to make sure batch_size is not larger than the whole message set
+        BATCH_SIZE=$(( $NUM_MESSAGES < 128 ? $NUM_MESSAGES : 128 ))
+        CUDA="--cuda --multigpu" # set "--cuda" if using CUDA and "" if not
+    fi
+    LOG_DIORA=$PWD/$LOGDIR/$1_diora.log
     
     (cd pipeline/diora/pytorch;
      export PYTHONPATH=$(pwd):$PYTHONPATH;
+     # Only in this subshell, such that the later steps (BMM, analysis) keep their own threading
+     if [[ $DIORA_CPU == true ]]; then
+         export OMP_NUM_THREADS=$NUM_THREADS MKL_NUM_THREADS=$NUM_THREADS;
+     fi
 
      echo "Training DIORA model..."
      python diora/scripts/train.py --data_type txt --emb w2v --embeddings_path $GLOVE_DIORA --train_path $CORPUS_DIORA --validation_path $CORPUS_DIORA --save_latest 1 --save_after 0 --experiment_path $DIORA_DIR_DIORA --max_epoch $EPOCHS $CUDA --batch_size $BATCH_SIZE --log_every_batch 1 | tee $LOG_DIORA;
 
      echo "Parse trees with trained diora model"
-     python diora/scripts/parse.py --data_type txt --embeddings_path glove/vectors.txt load_model_path output/model_periodic.pt python diora/scripts/parse.py --data_type txt --embeddings_path $GLOVE_DIORA --load_model_path $DIORA_DIR_DIORA/model_periodic.pt $CUDA --validation_path $CORPUS_DIORA --experiment_path "$DIORA_DIR_DIORA" > $LOG_DIORA #> $DIORA_DIR_DIORA/parse_trees_$1.txt
+     python diora/scripts/parse.py --data_type txt --embeddings_path $GLOVE_DIORA --load_model_path $DIORA_DIR_DIORA/model_periodic.pt $CUDA --batch_size $BATCH_SIZE --validation_path $CORPUS_DIORA --experiment_path "$DIORA_DIR_DIORA" >> $LOG_DIORA
     )
-    python utils/convert2constituents.py --bracket_file "$DIORA_DIR_DIORA/parse.jsonl" --format diora --shapes True --output "results/bmm/$1"
+    python utils/convert2constituents.py --bracket_file "$DIORA_DIR_DIORA/parse.jsonl" --format diora --shapes True --output "results/bmm/$1" --log_dir $LOGDIR
 }
 
 # Run BMM grammar induction
@@ -216,7 +268,7 @@ function grammar_induction {
 
     # Parse BMM output to clean PCFG
     mkdir -p results/grammars/$CONST
-    python utils/bmm_labels2grammar.py --grammar results/bmm/Output/Induced_Grammar.txt --output results/grammars/$CONST/$3.pcfg
+    python utils/bmm_labels2grammar.py --grammar results/bmm/Output/Induced_Grammar.txt --output results/grammars/$CONST/$3.pcfg --log_dir $LOGDIR
 
     ###########
     # Analysis
@@ -225,9 +277,9 @@ function grammar_induction {
 	    echo "Providing metrics for the induced grammar"
         
         if [[ $MESSAGE_LENGTH != false ]]; then
-	        python utils/analysis.py --parser $CONST --grammar "results/grammars/$CONST/$3.pcfg" --name "$1" --type "$2" --induct "$DATADIR/$3.txt" --eval "$DATADIR/$5.txt" --full "$DATADIR/$4.txt" --output results/grammars/analysis.csv -L "$MESSAGE_LENGTH" --overgeneration "$NUM_OVERGENERATION_SAMPLES" --log_dir $LOGDIR
+	        python utils/analysis.py --parser $CONST --grammar "results/grammars/$CONST/$3.pcfg" --name "$1" --type "$2" --induct "$DATADIR/$3.txt" --eval "$DATADIR/$5.txt" --full "$DATADIR/$4.txt" --output results/grammars/analysis.csv -L "$MESSAGE_LENGTH" --overgeneration "$NUM_OVERGENERATION_SAMPLES" --log_dir $LOGDIR $BEAM_FLAGS $PROFILE_FLAGS $BLOCK_FLAGS $STORE_FLAGS
         else
-            python utils/analysis.py --parser $CONST --grammar "results/grammars/$CONST/$3.pcfg" --name "$1" --type "$2" --induct "$DATADIR/$3.txt" --eval "$DATADIR/$5.txt" --full "$DATADIR/$4.txt" --output results/grammars/analysis.csv --log_dir $LOGDIR
+            python utils/analysis.py --parser $CONST --grammar "results/grammars/$CONST/$3.pcfg" --name "$1" --type "$2" --induct "$DATADIR/$3.txt" --eval "$DATADIR/$5.txt" --full "$DATADIR/$4.txt" --output results/grammars/analysis.csv --log_dir $LOGDIR $BEAM_FLAGS $PROFILE_FLAGS $BLOCK_FLAGS $STORE_FLAGS
         fi
     fi
 }
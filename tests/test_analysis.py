@@ -0,0 +1,23 @@
+import random
+from collections import Counter
+import pytest
+from analysis import reservoir_update
+
+def test_reservoir_update_samples_all_blocks_uniformly():
+    random.seed(0)
+    counts = Counter()
+    trials = 4000
+    for _ in range(trials):
+        sample, seen = [], 0
+        for start in range(0, 100, 10):
+            seen = reservoir_update(sample, range(start, start + 10), seen, 5)
+        assert seen == 100 and len(set(sample)) == 5
+        counts.update(sample)
+    for block in range(10):
+        frequency = sum(counts[i] for i in range(10 * block, 10 * block + 10)) / trials
+        assert frequency == pytest.approx(0.5, abs=0.05)
+
+def test_reservoir_update_keeps_small_inputs():
+    sample = []
+    assert reservoir_update(sample, ['a', 'b'], 0, 5) == 2
+    assert sample == ['a', 'b']
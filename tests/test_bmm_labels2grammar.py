@@ -0,0 +1,20 @@
+import pytest
+import bmm_labels2grammar
+
+@pytest.mark.parametrize('grammar_string, valid', [
+    ("TOP -> A B [0.5] | B [0.5]\nA -> '1' [1.0]\nB -> '2' [0.995] | A [0.005]", True),
+    ("TOP -> A B [0.5] | B [0.6]\nA -> '1' [1.0]\nB -> '2' [1.0]", False),
+    ("TOP -> A [1.0]\nA -> '1' [1.5] | '2' [-0.5]", False),
+])
+def test_check_grammar_agrees_with_nltk(grammar_string, valid):
+    try:
+        bmm_labels2grammar.pcfg_fromstring(grammar_string)
+        nltk_valid = True
+    except ValueError:
+        nltk_valid = False
+    assert nltk_valid == valid
+    if valid:
+        bmm_labels2grammar.check_grammar(grammar_string)
+    else:
+        with pytest.raises(ValueError):
+            bmm_labels2grammar.check_grammar(grammar_string)
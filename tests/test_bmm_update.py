@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import bmm_labels2grammar
+from bmm_update import read_rules, update_grammar
+from cky import CKYViterbiParser
+
+GRAMMAR = "TOP -> A B [0.6] | B A [0.4]\nA -> '1' [0.5] | '2' [0.5]\nB -> '3' [1.0]"
+
+def leaves(tree):
+    return [w for t in tree for w in (leaves(t) if isinstance(t, tuple) else [t])]
+
+def test_updated_grammar_parses_new_messages():
+    trees = [
+        ('9', '3'), # unknown word completed to the class of '1' and '2'
+        ('3', '9'),
+        ('3', ('8', '7')), # unknown words given new classes
+        ('1', ('2', '3')),
+        ('7', '3'), # unknown word already given a new class
+    ]
+    updated = update_grammar(GRAMMAR, 100, trees)
+    bmm_labels2grammar.check_grammar(updated)
+    parser = CKYViterbiParser(bmm_labels2grammar.pcfg_fromstring(updated))
+    messages = [leaves(t) for t in trees] + [['1', '3'], ['3', '2']]
+    assert np.isfinite(parser.logprob_sents(messages)).all()
+
+def test_new_classes_merge_into_existing_classes():
+    trees = [('7', '8'), ('7', '3')]
+    rules = read_rules(update_grammar(GRAMMAR, 100, trees))
+    assert set(rules) == {'TOP', 'A', 'B'}
+    assert "'7'" in {s for rhs in rules['A'] for s in rhs}
+    assert "'8'" in {s for rhs in rules['B'] for s in rhs}
+    # Without the description length, merging only loses likelihood
+    rules = read_rules(update_grammar(GRAMMAR, 100, trees, prior_weight=0))
+    assert len(rules) == 5
+
+def test_decay():
+    rules = read_rules(update_grammar(GRAMMAR, 100, [('1', '3')] * 50, decay=0.5))
+    assert rules['TOP'] == pytest.approx({('A', 'B'): 0.8, ('B', 'A'): 0.2})
+    assert rules['A'] == pytest.approx({("'1'",): 0.75, ("'2'",): 0.25})
+
+@pytest.mark.parametrize('messages, decay', [(100, 0), (0, 1)])
+def test_without_old_counts(messages, decay):
+    updated = update_grammar(GRAMMAR, messages, [('9', '8'), ('1', '3')], decay=decay)
+    bmm_labels2grammar.check_grammar(updated)
+    rules = read_rules(updated)
+    assert all(prob > 0 for rhss in rules.values() for prob in rhss.values())
+    assert "'2'" not in {s for rhss in rules.values() for rhs in rhss for s in rhs}
@@ -0,0 +1,100 @@
+import json
+import math
+import os
+import random
+import numpy as np
+import pytest
+from nltk import PCFG
+from nltk.parse.viterbi import ViterbiParser
+from cky import CKYViterbiParser, CompiledGrammar
+
+'''
+Checks that the array CKY parser gives the same Viterbi parses and probabilities
+as nltk's ViterbiParser, on random grammars with lexical, unary, binary, ternary
+and mixed (terminal and nonterminal) rules, also when the grammar is saved and loaded.
+'''
+
+def random_grammar(rng, nonterminals=4, words=4, rules=6):
+    ''' Returns a random PCFG with start symbol S and its terminals '''
+    children = [f"N{i}" for i in range(nonterminals)]
+    terminals = [f"w{i}" for i in range(words)]
+    lines = []
+    for lhs in ['S'] + children:
+        rhss = set()
+        while len(rhss) < rules:
+            kind = rng.random()
+            if kind < 0.3:
+                rhs = (f"'{rng.choice(terminals)}'",)
+            elif kind < 0.45:
+                rhs = (rng.choice(children),)
+            elif kind < 0.8:
+                rhs = tuple(rng.choice(children) for _ in range(2))
+            elif kind < 0.9:
+                rhs = tuple(rng.choice(children) for _ in range(3))
+            else:
+                rhs = (f"'{rng.choice(terminals)}'", rng.choice(children))
+            rhss.add(' '.join(rhs))
+        weights = [rng.random() + 0.1 for _ in rhss]
+        probs = [w / sum(weights) for w in weights]
+        lines.append(f"{lhs} -> " + " | ".join(f"{rhs} [{p!r}]" for rhs, p in zip(sorted(rhss), probs)))
+    return PCFG.fromstring("\n".join(lines)), terminals
+
+def derivation_logprob(grammar, tree):
+    ''' Returns the log2 probability of the rules of the tree, or None if a rule is not in the grammar '''
+    probs = {(p.lhs(), p.rhs()): p.prob() for p in grammar.productions()}
+    logprob = 0.0
+    for production in tree.productions():
+        if (production.lhs(), production.rhs()) not in probs:
+            return None
+        logprob += math.log2(probs[production.lhs(), production.rhs()])
+    return logprob
+
+@pytest.mark.parametrize('seed', range(20))
+def test_cky_matches_nltk_viterbi(seed):
+    rng = random.Random(seed)
+    grammar, _ = random_grammar(rng)
+    words = sorted({w for p in grammar.productions() for w in p.rhs() if isinstance(w, str)})
+    sents = [tuple(rng.choice(words) for _ in range(rng.randint(1, 6))) for _ in range(40)]
+    exact = ViterbiParser(grammar)
+    parsed = 0
+    for sent, trees in zip(sents, CKYViterbiParser(grammar).parse_sents(sents)):
+        expected = list(exact.parse(sent))
+        trees = list(trees)
+        assert len(trees) == len(expected), sent
+        if not expected:
+            continue
+        parsed += 1
+        tree, expected = trees[0], expected[0]
+        assert tree.logprob() == pytest.approx(expected.logprob(), abs=1e-9), sent
+        if str(tree) != str(expected):
+            # Another parse of the same (Viterbi) probability, e.g. with the same rules in another order
+            assert tuple(tree.leaves()) == sent
+            assert derivation_logprob(grammar, tree) == pytest.approx(expected.logprob(), abs=1e-9), sent
+    assert parsed > 0
+
+@pytest.mark.parametrize('seed', range(20))
+def test_saved_grammar_parses_the_same(tmp_path, seed):
+    rng = random.Random(seed)
+    grammar, _ = random_grammar(rng)
+    words = sorted({w for p in grammar.productions() for w in p.rhs() if isinstance(w, str)})
+    sents = [tuple(rng.choice(words) for _ in range(rng.randint(1, 6))) for _ in range(40)]
+    compiled = CompiledGrammar(grammar)
+    compiled.save(str(tmp_path))
+    for mmap_mode in ['r', None]:
+        loaded = CompiledGrammar.load(str(tmp_path), mmap_mode)
+        assert np.array_equal(CKYViterbiParser(loaded).logprob_sents(sents), CKYViterbiParser(compiled).logprob_sents(sents))
+        for trees, expected in zip(CKYViterbiParser(loaded).parse_sents(sents), CKYViterbiParser(compiled).parse_sents(sents)):
+            assert [str(t) for t in trees] == [str(t) for t in expected]
+
+def test_load_rejects_other_bundle_versions(tmp_path):
+    grammar, _ = random_grammar(random.Random(0))
+    CompiledGrammar(grammar).save(str(tmp_path))
+    assert CompiledGrammar.bundle_version(str(tmp_path)) is not None
+    with open(os.path.join(str(tmp_path), "symbols.json")) as f:
+        symbols = json.load(f)
+    del symbols['version']
+    with open(os.path.join(str(tmp_path), "symbols.json"), 'w') as f:
+        json.dump(symbols, f)
+    with pytest.raises(ValueError):
+        CompiledGrammar.load(str(tmp_path))
+    assert CompiledGrammar.bundle_version(str(tmp_path / 'missing')) is None
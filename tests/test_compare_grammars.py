@@ -0,0 +1,23 @@
+import os
+from compare_grammars import export_grammars
+from cky import CompiledGrammar
+
+def write(path, grammar_string):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(grammar_string)
+    return path
+
+def test_export_grammars_keys_bundles_by_contents(tmp_path):
+    ccl = write(str(tmp_path / 'ccl' / 'V6L3s0.pcfg'), "TOP -> A A [1.0]\nA -> '1' [1.0]")
+    diora = write(str(tmp_path / 'diora' / 'V6L3s0.pcfg'), "TOP -> A [1.0]\nA -> '2' [1.0]")
+    bundle_dir = str(tmp_path / 'bundles')
+    [ccl_bundle] = export_grammars([ccl], bundle_dir)
+    [diora_bundle] = export_grammars([diora], bundle_dir)
+    assert ccl_bundle != diora_bundle
+    assert CompiledGrammar.load(ccl_bundle).terminals == ['1']
+    assert CompiledGrammar.load(diora_bundle).terminals == ['2']
+    # The same grammar reuses its bundle
+    mtime = os.path.getmtime(os.path.join(ccl_bundle, "symbols.json"))
+    assert export_grammars([ccl], bundle_dir) == [ccl_bundle]
+    assert os.path.getmtime(os.path.join(ccl_bundle, "symbols.json")) == mtime
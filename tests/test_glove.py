@@ -0,0 +1,29 @@
+import numpy as np
+from glove import build_vocab, cooccurrence_matrix
+
+def naive_cooccurrence(messages, vocab, window_size=15):
+    ''' Counts the co-occurrences pair by pair like GloVe's cooccur '''
+    index = {w: i for i, w in enumerate(vocab)}
+    X = np.zeros((len(vocab), len(vocab)))
+    for m in messages:
+        ids = [index[w] for w in m if w in index]
+        for i in range(len(ids)):
+            for j in range(i+1, min(i + window_size, len(ids) - 1) + 1):
+                X[ids[i], ids[j]] += 1 / (j - i)
+                X[ids[j], ids[i]] += 1 / (j - i)
+    return X
+
+def test_cooccurrence_matrix():
+    rng = np.random.RandomState(0)
+    messages = [tuple(str(w) for w in rng.randint(0, 6, size=rng.randint(1, 20))) for _ in range(200)]
+    vocab = build_vocab(messages)
+    assert np.allclose(cooccurrence_matrix(messages, vocab, 5), naive_cooccurrence(messages, vocab, 5))
+
+def test_cooccurrence_matrix_empty_messages():
+    # A blank line and messages of which (all but one of) the words are below min_count
+    messages = [('1', '2', '1', '2'), (), ('rare', 'unseen')] * 5 + [('rare', '1')]
+    vocab = build_vocab(messages, min_count=7)
+    assert vocab == ['1', '2']
+    X = cooccurrence_matrix(messages, vocab)
+    assert np.allclose(X, naive_cooccurrence(messages, vocab))
+    assert X[0, 1] > 0
@@ -0,0 +1,8 @@
+import pytest
+from induce import induce_grammar
+
+def test_bracket_file_must_match_the_messages(tmp_path):
+    bracket_file = tmp_path / 'messages.ccl'
+    bracket_file.write_text("((1 2) 3)\n(2 (1 3))\n")
+    with pytest.raises(ValueError, match="2 trees for 3 messages"):
+        induce_grammar(["1 2 3", "2 1 3", "3 3 1"], bracket_file=str(bracket_file), work_dir=str(tmp_path), analyse=False)
@@ -0,0 +1,38 @@
+import random
+import numpy as np
+import pytest
+from nltk import Tree
+from parse_store import ParseStore, ParseStoreWriter
+
+def random_tree(rng, words, depth=0):
+    if depth == 3 or rng.random() < 0.3:
+        return Tree(rng.choice('ABC'), [rng.choice(words)])
+    return Tree('TOP' if depth == 0 else rng.choice('DEF'), [random_tree(rng, words, depth+1) for _ in range(rng.randint(1, 3))])
+
+def parses(n=200):
+    rng = random.Random(0)
+    words = [str(w) for w in range(10)]
+    return [(i, None if rng.random() < 0.2 else random_tree(rng, words), rng.randint(0, 4), -rng.random()) for i in range(0, 3 * n, 3)]
+
+@pytest.mark.parametrize('flush_size, in_directory', [(1000000, False), (7, False), (7, True), (1, True)])
+def test_round_trip(tmp_path, flush_size, in_directory):
+    writer = ParseStoreWriter(flush_size, str(tmp_path / 'parses') if in_directory else None)
+    expected = parses()
+    for message_id, tree, depth, log2prob in expected:
+        writer.add(message_id, tree, depth, log2prob)
+    writer.to_store().save(str(tmp_path / 'store.parses.npz'))
+    store = ParseStore.load(str(tmp_path / 'store.parses.npz'))
+
+    assert len(store) == len(expected)
+    assert store.parsed.tolist() == [tree is not None for _, tree, _, _ in expected]
+    assert store.message_ids.tolist() == [message_id for message_id, _, _, _ in expected]
+    assert store.depths.tolist() == [-1 if tree is None else depth for _, tree, depth, _ in expected]
+    assert np.allclose(store.log2probs, [np.nan if tree is None else p for _, tree, _, p in expected], equal_nan=True)
+    for message_id, tree, _, _ in random.Random(1).sample(expected, len(expected)):
+        assert store.get(message_id) == tree
+    with pytest.raises(KeyError):
+        store.get(1)
+
+def test_empty(tmp_path):
+    store = ParseStoreWriter(directory=str(tmp_path)).to_store()
+    assert len(store) == 0 and store.offsets.tolist() == [0]
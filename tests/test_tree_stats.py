@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from nltk import Tree
+from parse_store import ParseStoreWriter
+from tree_stats import TreeArrays, structural_statistics
+
+def small_store():
+    writer = ParseStoreWriter()
+    writer.add(0, Tree.fromstring("(TOP (A 1) (B 3))"), depth=1)
+    writer.add(1, Tree.fromstring("(TOP (A 2) (B 3))"), depth=1)
+    writer.add(2, Tree.fromstring("(TOP (B 3) (C (A 1) (B 3)))"), depth=2)
+    writer.add(3, None)
+    return writer.to_store()
+
+def test_structural_statistics():
+    stats = structural_statistics(small_store())
+    assert stats['trees'] == 3
+    # The first two trees only differ in their words
+    assert stats['unique_trees'] == 2
+    assert stats['unique_structures'] == 2
+    assert stats['tree_diversity'] == pytest.approx(2 / 3)
+    assert stats['depth_histogram'] == {1: 2, 2: 1}
+    assert stats['branching_histogram'] == {2: 4}
+    assert stats['rules_used'] == 6
+    assert stats['rule_usage'] == {"B -> '3'": 4, "TOP -> A B": 2, "A -> '1'": 2, "A -> '2'": 1, "TOP -> B C": 1, "C -> A B": 1}
+    assert stats['constituent_length_histogram'] == {2: 1}
+    assert stats['span_profile'] == {'1-3': pytest.approx(1 / 3)}
+
+def test_tree_hashes():
+    store = small_store()
+    trees = TreeArrays(store)
+    assert trees.tree_depths().tolist() == [1, 1, 2, -1]
+    assert len(np.unique(trees.tree_hashes(words=True)[store.parsed])) == 3
+    assert len(np.unique(trees.tree_hashes(nonterminals=False, words=True)[store.parsed])) == 3
+    structures = trees.tree_hashes(nonterminals=False)
+    assert structures[0] == structures[1] != structures[2]
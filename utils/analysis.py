@@ -2,14 +2,30 @@ import argparse
 import numpy as np
 import nltk
 from nltk import PCFG, Nonterminal
-from nltk.parse.viterbi import ViterbiParser
+from cky import CKYViterbiParser, CompiledGrammar
+import instrument
 import statistics
 import random
 import csv
+import json
 import os
 import re
+import shutil
 from datetime import datetime
 import logging
+from collections import Counter
+
+def positive_int(value):
+    """Argument type of a positive integer (e.g. a beam width)."""
+    if int(value) <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return int(value)
+
+def non_negative_float(value):
+    """Argument type of a float of at least 0 (e.g. a beam threshold)."""
+    if float(value) < 0:
+        raise argparse.ArgumentTypeError(f"{value} is negative")
+    return float(value)
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--grammar', type=str, required=True,
@@ -29,37 +45,42 @@ parser.add_argument('--full', type=str, required=True,
 parser.add_argument('--output', type=str, required=True,
                     help="Path to output csv file with metrics")
 parser.add_argument('-L', type=int, required=False,
-                    help="Fixed message length of the language (required for overgeneration coverage).")
+                    help="Fixed message length of the language (required for overgeneration coverage); messages of this length are parsed as one array.")
 parser.add_argument('--overgeneration', type=int, default=0,
                     help="Testing overgeneration coverage with this number of samples (requires setting -L).")
 parser.add_argument('--log_dir', type=str, required=False,
                     help="The directory for storing the log file.")
+parser.add_argument('--beam_width', type=positive_int, default=None,
+                    help="Approximate the Viterbi parses by keeping at most this number of nonterminals per chart cell.")
+parser.add_argument('--beam_threshold', type=non_negative_float, default=None,
+                    help="Approximate the Viterbi parses by pruning nonterminals with a log2 probability this much below the best one in the chart cell.")
+parser.add_argument('--beam_validation', type=int, default=100,
+                    help="Number of messages for comparing the beam-pruned parses with the exact Viterbi parses.")
+parser.add_argument('--block_size', type=int, default=None,
+                    help="Read and parse the messages in blocks of this size to bound the memory use; the parses are written to the log directory (or the directory of the output file).")
+parser.add_argument('--parse_store', action='store_true',
+                    help="Save the Viterbi parses of the messages in compact arrays (see parse_store.py) to the log directory (or the directory of the output file).")
+parser.add_argument('--profile', type=str, default=None, choices=['cprofile', 'pyinstrument'],
+                    help="Profile the Viterbi parsing and write the profiles to the log directory (requires --log_dir).")
 
 # Necessary to also recognise numbers such as 1e-5
 # original: nltk.grammar_PROBABILITY_RE = re.compile(r'( \[ [\d\.]+ \] ) \s*', re.VERBOSE)
 nltk.grammar._PROBABILITY_RE = re.compile(r'( \[([\d\.]+)(e-\d*)?\] ) \s*', re.VERBOSE)
 
+def read_grammar(filename):
+    """Reads an induced PCFG from file, with start symbol TOP."""
+    with open(filename, 'r') as f:
+        pcfg = PCFG.fromstring(f.read())
+    pcfg._start = Nonterminal('TOP')
+    return pcfg
+
+def compile_grammar(pcfg):
+    """Returns the CompiledGrammar of the PCFG (which may already be compiled)."""
+    return pcfg if isinstance(pcfg, CompiledGrammar) else CompiledGrammar(pcfg)
+
 def get_terminals(pcfg):
     """Returns a list of all the terminals in the PCFG."""
-    prods_lexical = [prod for prod in pcfg.productions() if type(prod.rhs()[0]) == str]
-    preterminals = {}
-    terminals = {}
-    for prod in prods_lexical:
-        pt = str(prod.lhs())
-        symbol = list(prod.rhs())
-        # preterminals
-        if pt not in preterminals:
-            preterminals[pt] = symbol
-        else:
-            preterminals[pt] = preterminals[pt] + symbol
-
-        # terminals
-        symbol = ''.join(symbol)
-        if symbol not in terminals:
-            terminals[symbol] = [pt]
-        else:
-            terminals[symbol] = terminals[symbol] + [pt]
-    return list(terminals.keys())
+    return list(compile_grammar(pcfg).lexicon.terminals)
 
 def sample_message(L,vocabulary):
     """
@@ -74,24 +95,25 @@ def overgeneration_coverage(pcfg, L, num_samples):
     """
     Test the overgeneration coverage with num_samples random messages with message length L.
     Returns % of successfull parses.
+    The messages are encoded into one (num_samples, L) array and recognised with the CKY parser
+    in batches, without building the parse trees.
     """
-    parser = ViterbiParser(pcfg)
-    
-    parse_total = 0 # Total number of messages tried to parse
-    parse_success = 0 # Total number successfully parsed
-
+    compiled = compile_grammar(pcfg)
+    parser = CKYViterbiParser(compiled)
 
     # Get the random messages
-    vocabulary = get_terminals(pcfg)
-    for i in range(0,num_samples):
-        message = sample_message(L,vocabulary)
-        parse_total += 1
-        try:
-            if parser.parse_one(message):
-                parse_success += 1
-        except ValueError:
-            continue
-    return parse_success/parse_total*100
+    vocabulary = get_terminals(compiled)
+    messages = [sample_message(L,vocabulary) for i in range(0,num_samples)]
+    ids = compiled.lexicon.encode_fixed(messages, L)
+
+    parse_success = 0 # Total number successfully parsed
+    progress = instrument.Progress("Overgeneration sampling", num_samples)
+    for start in range(0, num_samples, parser.batch_size):
+        success = int(np.isfinite(parser.logprob_ids(ids[start:start+parser.batch_size])).sum())
+        parse_success += success
+        progress.update(len(ids[start:start+parser.batch_size]), success=success)
+    progress.finish()
+    return parse_success/num_samples*100
     
 
 def analyse_grammar(pcfg):
@@ -146,25 +168,7 @@ def get_stat_dicts(pcfg):
     a terminal/pre-terminal points to.
     E.g. A --> [1, 2, 3] and 1 --> [A, B, C]
     """
-    prods_lexical = [prod for prod in pcfg.productions() if type(prod.rhs()[0]) == str]
-    preterminals = {}
-    terminals = {}
-    for prod in prods_lexical:
-        pt = str(prod.lhs())
-        symbol = list(prod.rhs())
-        
-        # preterminals
-        if pt not in preterminals:
-            preterminals[pt] = symbol
-        else:
-            preterminals[pt] = preterminals[pt] + symbol
-
-        # terminals
-        if symbol[0] not in terminals:
-            terminals[symbol[0]] = list(pt)
-        else:
-            terminals[symbol[0]] = terminals[symbol[0]] + list(pt)
-    return preterminals, terminals
+    return compile_grammar(pcfg).word_classes()
 
 def prod_check_in_RHS(production, preterminals, terminals):
     """Check if prod.rhs() is a subset of l"""
@@ -255,49 +259,111 @@ def mean(l):
     else:
         return None
 
-def analyse_viterbi(pcfg, messages):
+def beam_mismatch(parser, messages, num_samples):
+    """
+    Compares the beam-pruned Viterbi parses of the parser with the exact Viterbi parses
+    for num_samples random messages.
+    Returns % of messages for which the pruned parse differs from the exact parse.
+    """
+    exact_parser = CKYViterbiParser(parser.compiled)
+    sample = random.sample(messages, min(num_samples, len(messages)))
+    if not sample:
+        return float('nan')
+    differ = 0
+    for pruned_trees, exact_trees in zip(parser.parse_sents(sample), exact_parser.parse_sents(sample)):
+        pruned_parses = [to_parse_string(tree) for tree in pruned_trees]
+        exact_parses = [to_parse_string(tree) for tree in exact_trees]
+        if pruned_parses != exact_parses:
+            differ += 1
+    return differ/len(sample)*100
+
+def reservoir_update(sample, items, seen, size):
+    """
+    Updates sample, a uniform random sample (a list of at most size items) of the seen items so far,
+    with the new items by reservoir sampling. Returns the number of items seen.
+    """
+    for item in items:
+        seen += 1
+        if len(sample) < size:
+            sample.append(item)
+        else:
+            j = random.randrange(seen)
+            if j < size:
+                sample[j] = item
+    return seen
+
+def viterbi_parses(parser, messages, progress=True, L=None):
+    """
+    Parses the unique messages covered by the terminals of the grammar in batches.
+    Returns the covered messages and a dictionary from these messages to a list with their Viterbi tree
+    (empty if the message cannot be parsed).
+    If all messages have length L, they are encoded into one (messages, L) array up front
+    and parsed with the same chart arrays (see CKYViterbiParser.parse_ids).
+    """
+    lexicon = parser.compiled.lexicon
+    if L:
+        unique = list(dict.fromkeys(messages))
+        try:
+            ids = lexicon.encode_fixed(unique, L)
+        except ValueError as e:
+            logging.warning(f"{e}, parsing them as messages of variable length")
+            L = None
+    if L:
+        is_covered = (ids >= 0).all(axis=1)
+        covered = [sent for sent, c in zip(unique, is_covered) if c]
+        progress = instrument.Progress("Viterbi parsing", len(covered)) if progress else None
+        trees = parser.parse_ids(ids[is_covered], progress=progress)
+        parses = {sent: [] if tree is None else [tree] for sent, tree in zip(covered, trees)}
+    else:
+        covered = list(dict.fromkeys(sent for sent in messages if lexicon.covers(sent)))
+        progress = instrument.Progress("Viterbi parsing", len(covered)) if progress else None
+        parses = {sent: list(tree_list) for sent, tree_list in zip(covered, parser.parse_sents(covered, progress=progress))}
+    if progress:
+        progress.finish()
+    return covered, parses
+
+def analyse_viterbi(pcfg, messages, beam_width=None, beam_threshold=None, validation=0, store=None, L=None):
         """
-        Infers the Viterbi parses of the fixed induction set, split induction set and evaluation set
-        Writes parses to txt file
-        Computes message likelihood, tree diversity and evaluation coverage
-        Writes these properties to a pickle file
-        Returns a list of strings for summarized properties
+        Infers the Viterbi parses of the messages
+        Computes message likelihood, tree depth and evaluation coverage
+        Returns a dictionary with the summarized properties
+        If store (a ParseStoreWriter) is given, the parse of each message is added to it
+        If L is set, the messages of fixed length L are parsed as one array (see viterbi_parses)
+
+        If beam_width or beam_threshold is set, the Viterbi parses are approximated with a pruned chart
+        and the % of differing parses on a subset of validation messages is added as 'beam_mismatch'
         """
         
-        # Get terminals
-        prods_lexical =    [prod for prod in pcfg.productions() if type(prod.rhs()[0]) == str]
-        terminals    = set([prod.rhs()[0] for prod in prods_lexical])
-        
         # Compute message likelihoods and tree depth
-        parser = ViterbiParser(pcfg)
+        parser = CKYViterbiParser(compile_grammar(pcfg), beam_width=beam_width, beam_threshold=beam_threshold)
         message_count = len(messages)
-        message_count_quarter = int(np.ceil(message_count/4))
-        lines_parse = []
-        trees = []
         tree_depths = []
         logprobs = []
         failed_parses = []
         parsed_count_weighted = 0
+
+        # Parse all messages covered by the terminals in batches
+        covered, parses = viterbi_parses(parser, messages, L=L)
         for i, sent in enumerate(messages):
-            sent = list(sent)
-            if all(sym in terminals for sym in sent):
-                tree_list = list(parser.parse(sent))
+            if sent in parses:
+                tree_list = parses[sent]
+                sent = list(sent)
                 if len(tree_list) == 1: # if the message can be parsed, tree_list contains one tree
                     tree = tree_list[0]
-                    parse = to_parse_string(tree)
-                    trees.append(parse)
                     tree_depths.append(tree_depth(tree))
                     logprobs.append(tree.logprob() / np.log(2)) # convert natural logarithm from tree to log base 2 for description length
                 else:
-                    parse = "NO_PARSE"
+                    tree = None
                     logprobs.append(None)
                     tree_depths.append(None)
                     failed_parses.append(sent)
             else:
-                parse = "NO_PARSE"
+                tree = None
                 logprobs.append(None)
                 tree_depths.append(None)
-                failed_parses.append(sent)
+                failed_parses.append(list(sent))
+            if store is not None:
+                store.add(i, tree, tree_depths[-1], logprobs[-1])
 
         # Compute final statistics
         parsed_count = len(ignore_none(logprobs))
@@ -309,12 +375,17 @@ def analyse_viterbi(pcfg, messages):
             'unparsed_count': unparsed_count,
             'parsed_count': parsed_count,
             'failedparses': failed_parses,
+            'chart_cells': parser.cells_filled,
         }
             
         # Evaluation coverage
         coverage = parsed_count / len(messages)
         eval_stats['coverage'] = coverage*100
         eval_stats['average_log2likelihood'] = mean(logprobs) or float('nan')
+
+        # Compare pruned parses with the exact Viterbi parses
+        if parser.pruned and validation > 0:
+            eval_stats['beam_mismatch'] = beam_mismatch(parser, covered, validation)
         
         return eval_stats
 
@@ -325,86 +396,240 @@ def load_messages(filename):
         data = [tuple(line.split()) for line in data]
     return data
 
-def main(args):
-    logging.info("Reading and preparing grammar from file")
-    # Read and prepare the grammar from file
-    with open(args.grammar, 'r') as f:
-        pcfg_string = f.read()
-    induced_grammar = PCFG.fromstring(pcfg_string)
-    induced_grammar._start = Nonterminal('TOP')
+class MessageBlocks:
+    """
+    The messages of a file, read in blocks of block_size messages (lists of tuples)
+    when iterated over, such that the whole file never has to be in memory.
+    """
+    def __init__(self, filename, block_size=100000):
+        self.filename = filename
+        self.block_size = block_size
+        self._count = None
+
+    def __iter__(self):
+        block = []
+        with open(self.filename, 'r') as f:
+            for line in f:
+                block.append(tuple(line.split()))
+                if len(block) == self.block_size:
+                    yield block
+                    block = []
+        if block:
+            yield block
+
+    def __len__(self):
+        if self._count is None:
+            with open(self.filename, 'r') as f:
+                self._count = sum(1 for _ in f)
+        return self._count
+
+def analyse_viterbi_blocks(pcfg, blocks, spill_prefix, beam_width=None, beam_threshold=None, validation=0, store=None, L=None):
+    """
+    Streaming version of analyse_viterbi for corpora that do not fit in memory:
+    parses the messages block by block (e.g. MessageBlocks) and folds the results into running aggregates
+    (counts, sum of log2 likelihoods and a histogram of the tree depths).
+    The parse (with its log2 likelihood) of each message is written to <spill_prefix>_parses.txt
+    and the messages that cannot be parsed to <spill_prefix>_failed.txt.
+    If store (a ParseStoreWriter) is given, the parse of each message is added to it.
+    With beam pruning, the validation messages of beam_mismatch are sampled from all blocks (see reservoir_update).
+    Returns a dictionary with the same summarized properties as analyse_viterbi
+    """
+    parser = CKYViterbiParser(compile_grammar(pcfg), beam_width=beam_width, beam_threshold=beam_threshold)
+    message_count = 0
+    parsed_count = 0
+    sum_logprobs = 0.0
+    depth_histogram = Counter()
+    validation_messages = [] # random sample of the covered messages of all blocks
+    covered_count = 0
+    progress = instrument.Progress("Viterbi parsing", len(blocks))
+    with open(spill_prefix+"_parses.txt", 'w') as f_parses, open(spill_prefix+"_failed.txt", 'w') as f_failed:
+        for block in blocks:
+            covered, parses = viterbi_parses(parser, block, progress=False, L=L)
+            block_parsed = 0
+            for sent in block:
+                tree_list = parses.get(sent)
+                if tree_list: # if the message can be parsed, tree_list contains one tree
+                    tree = tree_list[0]
+                    logprob = tree.logprob() / np.log(2) # convert natural logarithm from tree to log base 2 for description length
+                    depth = tree_depth(tree)
+                    sum_logprobs += logprob
+                    depth_histogram[depth] += 1
+                    block_parsed += 1
+                    f_parses.write(f"{logprob}\t{to_parse_string(tree)}\n")
+                else:
+                    tree, depth, logprob = None, -1, float('nan')
+                    f_parses.write("NaN\tNO_PARSE\n")
+                    f_failed.write(" ".join(sent) + "\n")
+                if store is not None:
+                    store.add(message_count, tree, depth, logprob)
+                message_count += 1
+            parsed_count += block_parsed
+            if parser.pruned and validation > 0:
+                covered_count = reservoir_update(validation_messages, covered, covered_count, validation)
+            progress.update(len(block), success=block_parsed)
+    progress.finish()
+
+    eval_stats = {
+        'unparsed_count': message_count - parsed_count,
+        'parsed_count': parsed_count,
+        'sum_log2likelihood': sum_logprobs,
+        'depth_histogram': dict(sorted(depth_histogram.items())),
+        'parses_file': spill_prefix+"_parses.txt",
+        'failedparses_file': spill_prefix+"_failed.txt",
+        'chart_cells': parser.cells_filled,
+        'coverage': parsed_count / message_count * 100 if message_count else float('nan'),
+        'average_log2likelihood': sum_logprobs / parsed_count if parsed_count else float('nan'),
+    }
 
-    logging.info("Reading and preparing induction and evaluation messages")
-    # Read and prepare induction/evaluation messages
-    induction_messages = load_messages(args.induct)
-    evaluation_messages = load_messages(args.eval)
+    # Compare pruned parses with the exact Viterbi parses
+    if parser.pruned and validation > 0:
+        eval_stats['beam_mismatch'] = beam_mismatch(parser, validation_messages, validation)
+    return eval_stats
+
+def analyse(induced_grammar, induction_messages, evaluation_messages, L=None, overgeneration=0,
+            beam_width=None, beam_threshold=None, beam_validation=100, spill_prefix="analysis", parse_store=False):
+    """
+    Computes the metrics of the induced grammar (a PCFG with start symbol TOP)
+    on the induction and evaluation messages (lists of tuples of words).
+    If the messages are MessageBlocks, they are parsed block by block (see analyse_viterbi_blocks)
+    and the parses are written to files starting with spill_prefix.
+    If parse_store is set, the parses are saved in a ParseStore to <spill_prefix>_<induct|eval>.parses.npz
+    and their structural statistics (see tree_stats.py) to <spill_prefix>_<induct|eval>_tree_stats.json
+    (for MessageBlocks, the store is built in the directory <spill_prefix>_<induct|eval>.parses, removed afterwards).
+    Returns a dictionary from the metric (column of analysis.csv) to its value.
+    """
+    if parse_store:
+        from parse_store import ParseStoreWriter
+        from tree_stats import structural_statistics
+
+    with instrument.stage('compile_grammar') as record:
+        compiled_grammar = CompiledGrammar(induced_grammar)
+        record['symbols'] = compiled_grammar.nonterminal_count
+        record['rules'] = compiled_grammar.rule_count
 
     # Get some metrics
     logging.info("Providing grammar related statistics")
     ## Grammar
-    grammar_results = analyse_grammar(induced_grammar)
+    with instrument.stage('analyse_grammar', rules=len(induced_grammar.productions())):
+        grammar_results = analyse_grammar(induced_grammar)
 
     logging.info("Providing word class statistics")
     ## Word classes
-    preterminals, terminals = get_stat_dicts(induced_grammar)
-    word_class_results = {
-        'avg terminals/preterminal' : calculate_average(preterminals),
-        'avg preterminals/terminal' : calculate_average(terminals),
-    }
+    with instrument.stage('word_classes', terminals=len(compiled_grammar.terminals)):
+        preterminals, terminals = get_stat_dicts(compiled_grammar)
+        word_class_results = {
+            'avg terminals/preterminal' : calculate_average(preterminals),
+            'avg preterminals/terminal' : calculate_average(terminals),
+        }
 
     ## Parses
     logging.info("Providing Viterbi parse related statistics")
-    induct_viterbi_results = analyse_viterbi(induced_grammar, induction_messages)
-    eval_viterbi_results = analyse_viterbi(induced_grammar, evaluation_messages)
-
-    # Write to file
-    args.output
-    
-    cols = ['name', 'parser', 'type', 'date+timestamp', 'induct_fp', 'eval_fp', 'full_fp']
-    vals = [args.name, args.parser, args.type, datetime.now(), args.induct, args.eval, args.full]
+    options = dict(beam_width=beam_width, beam_threshold=beam_threshold, validation=beam_validation, L=L)
+    viterbi_results = {}
+    for split, messages in [('induct', induction_messages), ('eval', evaluation_messages)]:
+        with instrument.stage('viterbi_'+split) as record, instrument.profile('viterbi_'+split):
+            store_dir = f"{spill_prefix}_{split}.parses" if parse_store and isinstance(messages, MessageBlocks) else None
+            store = ParseStoreWriter(directory=store_dir) if parse_store else None
+            if isinstance(messages, MessageBlocks):
+                results = analyse_viterbi_blocks(compiled_grammar, messages, f"{spill_prefix}_{split}", store=store, **options)
+            else:
+                results = analyse_viterbi(compiled_grammar, messages, store=store, **options)
+            if store is not None:
+                store = store.to_store()
+                store.save(f"{spill_prefix}_{split}.parses.npz")
+            record.update(messages=len(messages), parsed=results['parsed_count'], chart_cells=results['chart_cells'])
+        if store is not None:
+            with instrument.stage('tree_stats_'+split, messages=len(store)):
+                tree_stats = structural_statistics(store)
+            with open(f"{spill_prefix}_{split}_tree_stats.json", 'w') as f:
+                json.dump(tree_stats, f, indent=2)
+            logging.info(f"{tree_stats['unique_trees']} unique trees and {tree_stats['unique_structures']} unique tree structures "
+                         f"for {tree_stats['trees']} parsed {split} messages")
+            del store
+            if store_dir is not None:
+                shutil.rmtree(store_dir)
+        viterbi_results[split] = results
+    induct_viterbi_results, eval_viterbi_results = viterbi_results['induct'], viterbi_results['eval']
+    for split, results in [('induction', induct_viterbi_results), ('evaluation', eval_viterbi_results)]:
+        if 'beam_mismatch' in results:
+            logging.info(f"Beam-pruned parses differ from exact Viterbi parses for {results['beam_mismatch']:.2f}% of validated {split} messages")
+
+    results = {}
 
     ## Add grammar metrics
     grammar_metrics = ['log2prior', 'terminals', 'preterminals', 'recursive']
     #grammar_metrics = ['GDL', 'terminals', 'preterminals', 'recursive']
-    cols += grammar_metrics
     for m in grammar_metrics:
-        vals.append(grammar_results[m])
+        results[m] = grammar_results[m]
 
     ## Add word class metrics
     word_class_metrics = ['avg terminals/preterminal', 'avg preterminals/terminal']
-    cols += word_class_metrics
     for m in word_class_metrics:
-        vals.append(word_class_results[m])
+        results[m] = word_class_results[m]
     
     ## Add parse metrics
     parse_metrics = ['average_log2likelihood', 'coverage']
     #parse_metrics = ['average_DDL', 'coverage']
     for m in parse_metrics:
-        cols.append('induct_'+m)
-        vals.append(induct_viterbi_results[m])
-        cols.append('eval_'+m)
-        vals.append(eval_viterbi_results[m])
+        results['induct_'+m] = induct_viterbi_results[m]
+        results['eval_'+m] = eval_viterbi_results[m]
     logging.debug(str(eval_viterbi_results['average_log2likelihood']))
 
-    ## Add overgeneration coverage if -L and --overgeneration is set
-    overgeneration_metrics = ['overgeneration_coverage','overgeneration_coverage_N']
-    cols += overgeneration_metrics
-    if (args.overgeneration>0) and args.L:
+    ## Add overgeneration coverage if L and overgeneration is set
+    if (overgeneration>0) and L:
         logging.info("Estimating overgeneration coverage")
-        vals.append(overgeneration_coverage(induced_grammar, args.L, args.overgeneration))
+        with instrument.stage('overgeneration_coverage', messages=overgeneration):
+            results['overgeneration_coverage'] = overgeneration_coverage(compiled_grammar, L, overgeneration)
     else:
         logging.info("Skipping estimation of overgeneration coverage")
-        vals.append('NaN')
-    vals.append(args.overgeneration)
+        results['overgeneration_coverage'] = 'NaN'
+    results['overgeneration_coverage_N'] = overgeneration
 
     ## Add preterminal group metrics
     logging.info("Calculating preterminal group metrics")
-    preterminals, terminals = get_stat_dicts(induced_grammar)
-    nominals, groups, nominals_count, groups_count = get_stats_wordclass_groups(induced_grammar, preterminals, terminals)
-    preterminalgroup_metrics = ['number of nominals', 'number of pre-terminal groups', 'average number of pre-terminal groups generated by nominal']
-    cols += preterminalgroup_metrics
-    vals.append(len(nominals))
-    vals.append(len(groups))
-    vals.append(nominals_count)
+    with instrument.stage('preterminal_groups', rules=len(induced_grammar.productions())):
+        preterminals, terminals = get_stat_dicts(compiled_grammar)
+        nominals, groups, nominals_count, groups_count = get_stats_wordclass_groups(induced_grammar, preterminals, terminals)
+    results['number of nominals'] = len(nominals)
+    results['number of pre-terminal groups'] = len(groups)
+    results['average number of pre-terminal groups generated by nominal'] = nominals_count
+
+    ## Mark approximate (beam-pruned) parse metrics
+    results['beam_width'] = 'NaN' if beam_width is None else beam_width
+    results['beam_threshold'] = 'NaN' if beam_threshold is None else beam_threshold
+    results['induct_beam_mismatch'] = induct_viterbi_results.get('beam_mismatch', 'NaN')
+    results['eval_beam_mismatch'] = eval_viterbi_results.get('beam_mismatch', 'NaN')
+    return results
+
+def main(args):
+    logging.info("Reading and preparing grammar from file")
+    # Read and prepare the grammar from file
+    with instrument.stage('read_grammar') as record:
+        induced_grammar = read_grammar(args.grammar)
+        record['rules'] = len(induced_grammar.productions())
+
+    logging.info("Reading and preparing induction and evaluation messages")
+    # Read and prepare induction/evaluation messages
+    with instrument.stage('load_messages') as record:
+        if args.block_size:
+            # Messages are read block by block while parsing
+            induction_messages = MessageBlocks(args.induct, args.block_size)
+            evaluation_messages = MessageBlocks(args.eval, args.block_size)
+        else:
+            induction_messages = load_messages(args.induct)
+            evaluation_messages = load_messages(args.eval)
+        record['messages'] = len(induction_messages) + len(evaluation_messages)
+
+    spill_dir = args.log_dir or os.path.dirname(args.output) or "."
+    results = analyse(induced_grammar, induction_messages, evaluation_messages, L=args.L, overgeneration=args.overgeneration,
+                      beam_width=args.beam_width, beam_threshold=args.beam_threshold, beam_validation=args.beam_validation,
+                      spill_prefix=os.path.join(spill_dir, f"{args.name}_{args.type}"), parse_store=args.parse_store)
+
+    # Write to file
+    cols = ['name', 'parser', 'type', 'date+timestamp', 'induct_fp', 'eval_fp', 'full_fp']
+    vals = [args.name, args.parser, args.type, datetime.now(), args.induct, args.eval, args.full]
+    cols += list(results.keys())
+    vals += list(results.values())
     
     ## To csv file
     if not os.path.exists(args.output):
@@ -412,18 +637,32 @@ def main(args):
             writer = csv.writer(f)
             writer.writerows([cols]+[vals])
     else:
+        # The row is written in the columns of the existing file; beam-pruned results are only
+        # appended to a file with the beam columns, to not mix them with exact results unmarked
+        with open(args.output, 'r') as f:
+            header = next(csv.reader(f), [])
+        missing = [c for c in cols if c not in header]
+        if missing and (args.beam_width is not None or args.beam_threshold is not None):
+            raise ValueError(f"{args.output} has no columns {', '.join(missing)}; write the beam-pruned results to a new file")
+        if missing:
+            logging.warning(f"{args.output} has no columns {', '.join(missing)}, leaving them out")
+        row = dict(zip(cols, vals))
         with open(args.output, 'a') as f:
             writer = csv.writer(f)
-            writer.writerows([vals])
+            writer.writerows([[row.get(c, '') for c in header]])
     logging.info("Finished providing metrics for induced grammar")
     
 if __name__ == "__main__":  
     args = parser.parse_args()
+    if args.profile and not args.log_dir:
+        parser.error("--profile writes the profiles to the log directory, set --log_dir")
     if args.log_dir:
         logging.basicConfig(filename=args.log_dir+f"/{args.name}_grammar-analysis.log",
                             filemode='a',
                             format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
                             datefmt='%H:%M:%S',
                             level=logging.DEBUG)
+        instrument.start_trace(args.log_dir+"/trace.jsonl", profiler=args.profile,
+                               script='analysis', name=args.name, type=args.type)
     logging.info(f"Starting analysis of grammar {args.name} of type {args.type} and constituency parser {args.parser}")
     main(args)
@@ -2,9 +2,6 @@
 Classes for creating baseline messages or grammars.
 """
 
-import numpy as np
-from nltk import CFG, Nonterminal
-from nltk.parse.generate import generate
 from pathlib import Path
 import random
 import argparse
@@ -110,6 +107,8 @@ class StructuredBaseline(AbstractBaseline):
         -------
         grammar : nltk.CFG
         """
+        import numpy as np
+        from nltk import CFG, Nonterminal
         
         assert V>3, "V is too small, the minimum vocabulary size is 4."
         assert L>2, "L is too small, the minimum message length is 3."
@@ -177,6 +176,7 @@ class StructuredBaseline(AbstractBaseline):
         message : list
             A list with each element a word (str) in the message.
         """
+        from nltk.parse.generate import generate
         for message in generate(self.grammar):
             yield message
 
@@ -1,23 +1,25 @@
-from nltk import PCFG, CFG, Nonterminal
-from nltk.parse.viterbi import ViterbiParser
-from nltk.draw.tree import TreeView
-import nltk
 from itertools import count
 import re
 import argparse
 import os
+import instrument
 
 '''
 This script reads the grammar output from BMM labels and converts it
 to NLTKs PCFG.
 See https://www.nltk.org/_modules/nltk/grammar.html for useful documentation for PCFG
+NLTK (and tkinter for drawing trees) is only imported when the grammar is parsed or drawn,
+such that converting the grammar starts fast.
 '''
 
-# Necessary to also recognise numbers such as 1e-5
-# original: nltk.grammar_PROBABILITY_RE = re.compile(r'( \[ [\d\.]+ \] ) \s*', re.VERBOSE)
-nltk.grammar._PROBABILITY_RE = re.compile(r'( \[([\d\.]+)(e-\d*)?\] ) \s*', re.VERBOSE)
+PROBABILITY_RE = re.compile(r"\[([^\]]*)\]")
+EPSILON = 0.01 # tolerance of the sum of the probabilities of a lhs (as nltk's PCFG.EPSILON)
 
-TERMINALS = []
+def nonterminal_names():
+    ''' List of the short names of the nonterminals: letters, then pairs and triples of letters '''
+    alphabet = [chr(i) for i in range(ord('A'),ord('Z')+1)] + [chr(i) for i in range(ord('a'),ord('z')+1)] # List of letters
+    alphabet2 = [i+j for i in alphabet for j in alphabet]
+    return alphabet + alphabet2 + [i+j for i in alphabet2 for j in alphabet]
 
 def parse_induced_grammar(filepath):
     ''' Return string with grammar in format NLTK PCFG can read
@@ -38,11 +40,7 @@ def parse_induced_grammar(filepath):
             if "PRODUCTION RULES" in line:
                 # simplify non-terminals to letter pairs
                 wordid = dict(zip(set(non_terminals), count(1)))
-                alphabet = [chr(i) for i in range(ord('A'),ord('Z')+1)] + [chr(i) for i in range(ord('a'),ord('z')+1)] # List of letters
-                alphabet2 = [i+j for i in alphabet for j in alphabet]
-                alphabet = alphabet + alphabet2 + [i+j for i in alphabet2 for j in alphabet]
-                
-                dictionary = dict(zip(wordid, alphabet[:len(wordid)]))
+                dictionary = dict(zip(wordid, nonterminal_names()[:len(wordid)]))
                 flag_skip = False
                 continue
             if nonTFlag:
@@ -69,7 +67,6 @@ def parse_induced_grammar(filepath):
                     term = dictionary[term]
                 elif term.isdigit() or (not term in non_terminals) or (not "TOP" in term): # To have it accept as a terminal
                     term = f"'{term}'"
-                    TERMINALS.append(term) # Used for testing the PCFG
                 terms.append(term)
             terms = " ".join(terms)
             probability = line.split("*#")[1].rstrip()
@@ -79,26 +76,57 @@ def parse_induced_grammar(filepath):
     string += newline + left + " -> " + " | ".join(right)
     return string
 
+def pcfg_fromstring(grammar_string):
+    ''' Returns the NLTK PCFG (with start symbol TOP) of a grammar string of parse_induced_grammar '''
+    import nltk
+    from nltk import PCFG, Nonterminal
+    # Necessary to also recognise numbers such as 1e-5
+    # original: nltk.grammar_PROBABILITY_RE = re.compile(r'( \[ [\d\.]+ \] ) \s*', re.VERBOSE)
+    nltk.grammar._PROBABILITY_RE = re.compile(r'( \[([\d\.]+)(e-\d*)?\] ) \s*', re.VERBOSE)
+    grammar = PCFG.fromstring(grammar_string)
+    grammar._start = Nonterminal('TOP') # Not sure whether this is allowed or breaks things
+    return grammar
+
+def count_rules(grammar_string):
+    ''' Number of rules in a grammar string of parse_induced_grammar (one line per lhs, rules separated by |) '''
+    return sum(line.count(" | ") + 1 for line in grammar_string.splitlines() if line)
+
+def check_grammar(grammar_string):
+    ''' Checks without NLTK that the probabilities of the rules of each lhs of a grammar string
+    of parse_induced_grammar are between 0 and 1 and sum to 1, like PCFG.fromstring.
+    Raises a ValueError otherwise '''
+    for line in grammar_string.splitlines():
+        if not line.strip():
+            continue
+        lhs = line.split("->")[0].strip()
+        probabilities = [float(p) for p in PROBABILITY_RE.findall(line)]
+        if not probabilities or any(p < 0 or p > 1 for p in probabilities):
+            raise ValueError(f"Rules of {lhs} without probabilities between 0 and 1: {line}")
+        if abs(sum(probabilities) - 1) > EPSILON:
+            raise ValueError(f"Productions for {lhs} do not sum to 1 ({sum(probabilities)})")
+
 def test_PCFG(grammar, shapes=False):
     ''' Test whether the grammar can parse a sentence '''
-    #sent = [i.replace("'","") for i in TERMINALS[:5]]
     #sent = "in the middle center is a green square".split()
     if not shapes:
         sent = "2 2 2 12 2 12 2 2 12 2".split()
     else:
         sent = "in the middle center is a green square".split()
+    from nltk.parse.viterbi import ViterbiParser
     sr = ViterbiParser(grammar)
     for t in sr.parse(sent):
         t.draw()
 
 def main(config):
-    grammar_string = parse_induced_grammar( config.grammar )
+    with instrument.stage('parse_induced_grammar') as record:
+        grammar_string = parse_induced_grammar( config.grammar )
+        record['nonterminals'] = grammar_string.count("\n") + 1
+        record['rules'] = count_rules(grammar_string)
+        check_grammar(grammar_string)
 
     if config.output:
         with open(config.output, 'w') as f:
             f.write(grammar_string)
-    grammar = PCFG.fromstring( grammar_string )
-    grammar._start = Nonterminal('TOP') # Not sure whether this is allowed or breaks things
 
     # Create directory for parse_trees if it does not already exist
     if config.textfile:
@@ -106,6 +134,11 @@ def main(config):
             os.makedirs(config.output_parse)
     
     if config.textfile:
+        from nltk.parse.viterbi import ViterbiParser
+        from nltk.draw.tree import TreeView
+        with instrument.stage('pcfg_fromstring') as record:
+            grammar = pcfg_fromstring(grammar_string)
+            record['rules'] = len(grammar.productions())
         parser = ViterbiParser(grammar)
         with open(config.textfile, 'r') as f:
             lines = f.read().splitlines() 
@@ -124,5 +157,9 @@ if __name__ == "__main__":
     parser.add_argument('--textfile', type=str, default=None, help="Optional textfile to parse with the grammar.")
     parser.add_argument('--output_parse', type=str, default="parse_trees", help="Where to put the parse trees if parsing sentences.")
     parser.add_argument('--number_parses', type=int, default=10, help="Maximum number of lines to parse the corpus.")
+    parser.add_argument('--log_dir', type=str, default=None, help="Directory to append the trace of the stages (trace.jsonl) to.")
     config = parser.parse_args()
+    if config.log_dir:
+        instrument.start_trace(config.log_dir+"/trace.jsonl", script='bmm_labels2grammar',
+                               name=os.path.splitext(os.path.basename(config.output or config.grammar))[0])
     main(config)
@@ -0,0 +1,357 @@
+import argparse
+import logging
+import math
+import os
+import re
+from collections import Counter
+import bmm_labels2grammar
+import convert2constituents
+import instrument
+
+'''
+Incremental update of an induced grammar (.pcfg) with new bracketed messages (CCL or DIORA output),
+without running BMM on the whole corpus again:
+1. The rule counts of the grammar are recovered from its probabilities and the number of messages
+   it was induced from (for a grammar estimated by relative frequencies from labelled trees,
+   as BMM does, the expected rule counts equal the observed counts).
+2. The constituents of the new trees are labelled bottom-up with the existing nonterminals where
+   a rule with the same children exists (unknown words take the word class that completes such a rule),
+   otherwise with a new nonterminal per new sequence of children (and a new word class per unknown word).
+   The counts of the rules of the new trees are added to the counts.
+3. Only the new nonterminals are merged, each into the nonterminal (of the same kind: word class
+   or not) that gives the largest gain of the posterior (log likelihood of the counts minus the
+   prior weight times the description length of the grammar, with log2 of the number of symbols
+   bits per symbol of each rule), as long as there is a gain.
+The time is proportional to the number of new messages and the rules around the new nonterminals.
+
+Example usage:
+    python utils/bmm_update.py --grammar results/grammars/ccl/V6L3s0.pcfg --messages 10000 --bracket_file results/ccl/V6L3s0_new.ccl --format ccl --output results/grammars/ccl/V6L3s0_updated.pcfg
+'''
+
+START = 'TOP'
+RULE_TOKEN_RE = re.compile(r"'[^']*'|\[[^\]]*\]|\||->|\S+")
+
+def is_terminal(symbol):
+    return symbol.startswith("'")
+
+def xlog2x(count):
+    ''' count * log2(count), with 0 log 0 = 0 '''
+    return count * math.log2(count) if count > 0 else 0.0
+
+def non_negative_int(value):
+    """Argument type of an integer of at least 0 (e.g. a number of messages)."""
+    if int(value) < 0:
+        raise argparse.ArgumentTypeError(f"{value} is negative")
+    return int(value)
+
+def positive_float(value):
+    """Argument type of a float larger than 0 (e.g. a decay)."""
+    if float(value) <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not positive")
+    return float(value)
+
+def read_rules(grammar_string):
+    ''' Returns the rules of a grammar string (as written by bmm_labels2grammar, or NLTK productions)
+    as a dictionary lhs -> {rhs: probability}, with rhs a tuple of labels and quoted terminals '''
+    rules = {}
+    for line in grammar_string.splitlines():
+        tokens = RULE_TOKEN_RE.findall(line)
+        if not tokens:
+            continue
+        lhs, rhs = tokens[0], []
+        for token in tokens[2:]:
+            if token.startswith('['):
+                rules.setdefault(lhs, {})[tuple(rhs)] = float(token[1:-1])
+                rhs = []
+            elif token != '|':
+                rhs.append(token)
+    return rules
+
+def expected_usage(rules, start=START, tolerance=1e-12, max_iterations=100000):
+    ''' Returns the expected number of times each nonterminal is used in a derivation of the grammar,
+    by iterating usage = start + usage of the parents * probability of the rules until it converges '''
+    import numpy as np
+    index = {lhs: i for i, lhs in enumerate(rules)}
+    parents, children, probs = [], [], []
+    for lhs, rhss in rules.items():
+        for rhs, prob in rhss.items():
+            for s in rhs:
+                if s in index:
+                    parents.append(index[lhs])
+                    children.append(index[s])
+                    probs.append(prob)
+    parents, children, probs = np.array(parents, dtype=np.intp), np.array(children, dtype=np.intp), np.array(probs)
+    source = np.zeros(len(index))
+    source[index[start]] = 1
+    usage = source
+    for _ in range(max_iterations):
+        updated = source + np.bincount(children, weights=usage[parents] * probs, minlength=len(index))
+        if np.abs(updated - usage).max() <= tolerance * updated.max():
+            usage = updated
+            break
+        usage = updated
+    else:
+        logging.warning("The expected usage of the nonterminals did not converge (is the grammar consistent?)")
+    return dict(zip(index, usage.tolist()))
+
+class RuleCounts:
+    '''
+    Counts of the rules of a grammar with indices to find the rules around a nonterminal:
+    the lhs of each rhs, the rules in which each nonterminal occurs (occurrences) and, for each
+    rhs with one position left out (a context, the left out position None), the pairs (lhs, nonterminal)
+    that complete it. The counts of the rules are initialised from their probabilities (see expected_usage),
+    weighted by decay (rules without a positive count are left out). The posterior of the grammar is the log2
+    likelihood of the counts minus prior_weight times the description length of the rules: log2 of the number
+    of symbols (nonterminals and terminals) for each symbol of each rule (the lhs and the rhs).
+    '''
+
+    def __init__(self, rules, messages, prior_weight=1.0, decay=1.0):
+        self.rules = {}
+        self.totals = Counter()
+        self.by_rhs = {}
+        self.occurrences = {}
+        self.contexts = {}
+        self.length = 0 # number of symbols of all rules
+        self.prior_weight = prior_weight
+        usage = expected_usage(rules)
+        for lhs, rhss in rules.items():
+            for rhs, prob in rhss.items():
+                self.add(lhs, rhs, prob * usage[lhs] * messages * decay)
+        self.lexical = {lhs for lhs, rhss in self.rules.items() if any(is_terminal(s) for rhs in rhss for s in rhs)}
+        self.terminals = len({s for rhs in self.by_rhs for s in rhs if is_terminal(s)})
+
+    def add(self, lhs, rhs, count):
+        if count <= 0:
+            return
+        rhss = self.rules.setdefault(lhs, Counter())
+        if rhs not in rhss:
+            self.length += len(rhs) + 1
+            self.by_rhs.setdefault(rhs, set()).add(lhs)
+            for i, s in enumerate(rhs):
+                if not is_terminal(s):
+                    self.occurrences.setdefault(s, set()).add((lhs, rhs))
+                self.contexts.setdefault(rhs[:i] + (None,) + rhs[i+1:], set()).add((lhs, s))
+        rhss[rhs] += count
+        self.totals[lhs] += count
+
+    def remove(self, lhs, rhs):
+        ''' Removes the rule, returns its count '''
+        count = self.rules[lhs].pop(rhs)
+        self.length -= len(rhs) + 1
+        self.totals[lhs] -= count
+        if not self.rules[lhs]:
+            del self.rules[lhs], self.totals[lhs]
+        self.by_rhs[rhs].discard(lhs)
+        for i, s in enumerate(rhs):
+            if not is_terminal(s):
+                self.occurrences[s].discard((lhs, rhs))
+            self.contexts[rhs[:i] + (None,) + rhs[i+1:]].discard((lhs, s))
+        return count
+
+    def best_lhs(self, rhs, top=False):
+        ''' The lhs (TOP if top, else any other) with the largest count of a rule rhs, or None '''
+        candidates = [lhs for lhs in self.by_rhs.get(rhs, ()) if (lhs == START) == top]
+        return max(candidates, key=lambda lhs: (self.rules[lhs][rhs], lhs), default=None)
+
+    def complete(self, rhs, top=False):
+        ''' Returns the word class for the position None of rhs that gives the rule
+        (of TOP if top, else of any other lhs) with the largest count, or None '''
+        fill = lambda s: tuple(s if c is None else c for c in rhs)
+        candidates = [(self.rules[lhs][fill(s)], s) for lhs, s in self.contexts.get(rhs, ())
+                      if (lhs == START) == top and s in self.lexical]
+        return max(candidates, default=(None, None))[1]
+
+    @property
+    def symbol_count(self):
+        return len(self.rules) + self.terminals
+
+    def description_length(self, length, symbols):
+        return length * math.log2(symbols)
+
+    def _merged(self, a, b):
+        ''' Returns the rules (lhs -> {rhs: count}) that change by merging a into b, before and after '''
+        rename = lambda rhs: tuple(b if s == a else s for s in rhs)
+        before = {}
+
+        def take(lhs, rhs):
+            if rhs in self.rules.get(lhs, ()):
+                before.setdefault(lhs, {})[rhs] = self.rules[lhs][rhs]
+
+        for rhs in self.rules[a]:
+            take(a, rhs)
+            take(b, rename(rhs))
+        for lhs, rhs in self.occurrences.get(a, ()):
+            take(lhs, rhs)
+            take(b if lhs == a else lhs, rename(rhs))
+        after = {}
+        for lhs, rhss in before.items():
+            merged = after.setdefault(b if lhs == a else lhs, Counter())
+            for rhs, count in rhss.items():
+                merged[rename(rhs)] += count
+        return before, after
+
+    def merge_gain(self, a, b):
+        ''' Change of the posterior by merging nonterminal a into b, from the rules that change only
+        (the log likelihood of the counts of a lhs is sum(c log c) - total log total) '''
+        before, after = self._merged(a, b)
+        xlogx = lambda rhss: sum(xlog2x(c) for c in rhss.values())
+        total_a, total_b = self.totals[a], self.totals[b]
+        likelihood = (sum(xlogx(rhss) for rhss in after.values()) - sum(xlogx(rhss) for rhss in before.values())
+                      - xlog2x(total_a + total_b) + xlog2x(total_a) + xlog2x(total_b))
+        # The collapsed rules are removed and a is no longer a symbol
+        length = self.length - sum(len(rhs) + 1 for rhss in before.values() for rhs in rhss) \
+                             + sum(len(rhs) + 1 for rhss in after.values() for rhs in rhss)
+        return likelihood + self.prior_weight * (self.description_length(self.length, self.symbol_count)
+                                                 - self.description_length(length, self.symbol_count - 1))
+
+    def merge(self, a, b):
+        ''' Replaces nonterminal a by b in all rules '''
+        before, after = self._merged(a, b)
+        for lhs, rhss in before.items():
+            for rhs in rhss:
+                self.remove(lhs, rhs)
+        for lhs, rhss in after.items():
+            for rhs, count in rhss.items():
+                self.add(lhs, rhs, count)
+        self.lexical.discard(a)
+
+    def merge_candidates(self, a):
+        ''' The nonterminals of the same kind as a (word class or not), other than TOP '''
+        lexical = a in self.lexical
+        return sorted(c for c in self.rules if c != a and c != START and (c in self.lexical) == lexical)
+
+    def to_string(self):
+        ''' Returns the grammar string (TOP first) in the format of bmm_labels2grammar '''
+        lines = []
+        for lhs in sorted(self.rules, key=lambda lhs: lhs != START):
+            rhss, total = self.rules[lhs], self.totals[lhs]
+            lines.append(f"{lhs} -> " + " | ".join(f"{' '.join(rhs)} [{count / total}]" for rhs, count in rhss.items()))
+        return "\n".join(lines)
+
+def label_trees(counts, trees):
+    '''
+    Labels the constituents of the trees (nested tuples of words) bottom-up and adds their rules to the counts.
+    Returns the list of the new nonterminals, in the order they were introduced (word classes first).
+    '''
+    names = (n for n in bmm_labels2grammar.nonterminal_names() if n not in counts.rules)
+    new_rules = {} # rhs -> new nonterminal
+    new_classes = {} # unknown word -> new word class
+    classes = {} # unknown word -> word class it was first given (new or existing)
+    new = []
+    rules = Counter()
+
+    def new_symbol(key, table):
+        if key not in table:
+            table[key] = next(names)
+            new.append(table[key])
+        return table[key]
+
+    def word_class(word):
+        term = f"'{word}'"
+        if term in classes:
+            return classes[term]
+        return counts.best_lhs((term,))
+
+    def label(tree, top=False):
+        children = [label(t) if isinstance(t, tuple) else word_class(t) for t in tree]
+        unknown = [i for i, c in enumerate(children) if c is None]
+        if len(unknown) == 1:
+            children[unknown[0]] = counts.complete(tuple(children), top)
+        for i, word in enumerate(tree):
+            if isinstance(word, tuple):
+                continue
+            term = f"'{word}'"
+            if children[i] is None:
+                children[i] = new_symbol(term, new_classes)
+            if i in unknown:
+                classes.setdefault(term, children[i])
+            rules[children[i], (term,)] += 1
+        rhs = tuple(children)
+        lhs = START if top else counts.best_lhs(rhs) or new_symbol(rhs, new_rules)
+        rules[lhs, rhs] += 1
+        return lhs
+
+    progress = instrument.Progress("Labelling trees", len(trees), unit="trees")
+    for tree in trees:
+        label(tree if isinstance(tree, tuple) else (tree,), top=True)
+        progress.update(success=1)
+    progress.finish()
+    for (lhs, rhs), count in rules.items():
+        counts.add(lhs, rhs, count)
+    counts.lexical |= set(new_classes.values())
+    counts.terminals += len(classes)
+    return sorted(new, key=lambda n: n not in counts.lexical)
+
+def merge_locally(counts, symbols):
+    ''' Merges each of the symbols into its best merge candidate while it increases the posterior,
+    repeated until no symbol is merged. Returns the number of merges '''
+    merges = 0
+    remaining = list(symbols)
+    while remaining:
+        merged = set()
+        for a in remaining:
+            gains = [(counts.merge_gain(a, b), b) for b in counts.merge_candidates(a)]
+            gain, b = max(gains, default=(0, None))
+            if gain > 0:
+                logging.debug(f"Merging {a} into {b} (gain {gain:.2f} bits)")
+                counts.merge(a, b)
+                merged.add(a)
+        if not merged:
+            break
+        merges += len(merged)
+        remaining = [a for a in remaining if a not in merged]
+    return merges
+
+def read_trees(bracket_file, format='ccl'):
+    ''' Returns the trees of a CCL or DIORA bracket file as nested tuples of words '''
+    trees = (convert2constituents.parse2list_ccl(bracket_file) if format == 'ccl'
+             else convert2constituents.parse2list_diora(bracket_file, False))
+    return [convert2constituents.constituent_tree(t) for t in trees]
+
+def update_grammar(grammar_string, messages, trees, prior_weight=1.0, decay=1.0):
+    '''
+    Updates a grammar string (see bmm_labels2grammar) induced from messages messages with the
+    new trees (nested tuples of words, see read_trees). The counts of the old messages are weighted
+    by decay (e.g. < 1 to follow a drifting language). Returns the updated grammar string.
+    '''
+    with instrument.stage('prior_counts', messages=messages) as record:
+        counts = RuleCounts(read_rules(grammar_string), messages, prior_weight, decay)
+        record['nonterminals'] = len(counts.rules)
+    with instrument.stage('label_trees', messages=len(trees)) as record:
+        new = label_trees(counts, trees)
+        record['new_nonterminals'] = len(new)
+    with instrument.stage('merge_locally', nonterminals=len(new)) as record:
+        record['merges'] = merges = merge_locally(counts, new)
+    logging.info(f"Added {len(new) - merges} of {len(new)} new nonterminals, the grammar has {len(counts.rules)} nonterminals")
+    return counts.to_string()
+
+def main(config):
+    with open(config.grammar, 'r') as f:
+        grammar_string = f.read()
+    trees = [t for bracket_file in config.bracket_file for t in read_trees(bracket_file, config.format)]
+    grammar_string = update_grammar(grammar_string, config.messages, trees, config.prior_weight, config.decay)
+    with open(config.output, 'w') as f:
+        f.write(grammar_string)
+    print(f"Updated {config.grammar} with {len(trees)} messages ({config.messages + len(trees)} in total), "
+          f"{grammar_string.count(chr(10)) + 1} nonterminals and {bmm_labels2grammar.count_rules(grammar_string)} rules in {config.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grammar', '-g', type=str, required=True, help="Path to the induced grammar (.pcfg) to update.")
+    parser.add_argument('--messages', type=non_negative_int, required=True, help="Number of messages the grammar was induced from (the total of the previous updates).")
+    parser.add_argument('--bracket_file', type=str, nargs='+', required=True, help="Path(s) to the parsed new messages (bracketing).")
+    parser.add_argument('--format', type=str, default='ccl', help="Format of the bracket files. Options are <ccl>, <diora>")
+    parser.add_argument('--output', '-o', type=str, required=True, help="Save the updated grammar to this file path.")
+    parser.add_argument('--prior_weight', type=float, default=1.0, help="Weight of the description length of the rules against the likelihood when merging new nonterminals.")
+    parser.add_argument('--decay', type=positive_float, default=1.0, help="Weight of the counts of the old messages relative to the new ones.")
+    parser.add_argument('--log_dir', type=str, default=None, help="Directory for the log and trace files.")
+    config = parser.parse_args()
+    if config.log_dir:
+        logging.basicConfig(filename=os.path.join(config.log_dir, "bmm_update.log"),
+                            filemode='a',
+                            format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+                            datefmt='%H:%M:%S',
+                            level=logging.DEBUG)
+        instrument.start_trace(os.path.join(config.log_dir, "trace.jsonl"), script='bmm_update',
+                               name=os.path.splitext(os.path.basename(config.output))[0])
+    main(config)
@@ -0,0 +1,576 @@
+import json
+import os
+import numpy as np
+from nltk import Nonterminal
+from nltk.parse.api import ParserI
+from nltk.tree import ProbabilisticTree
+
+'''
+Array based CKY Viterbi parser for the induced PCFGs.
+The NLTK grammar is compiled once into binarized rule arrays, after which
+every chart cell is filled with vectorized operations over all rules
+instead of enumerating rule instantiations one by one.
+Optionally each chart cell is pruned to a beam, which gives an approximate
+Viterbi parse that skips the rules whose children fell out of the beam.
+A compiled grammar can be saved as a bundle of .npy files, which (worker)
+processes load memory-mapped, such that they share one copy of the arrays.
+'''
+
+# Backpointer codes in the rule chart
+NO_RULE = -1
+LEXICAL = -2
+
+# Kinds of symbols in the compiled grammar
+ORIGINAL = 0 # nonterminal of the PCFG
+SEQUENCE = 1 # introduced by binarizing a rule with more than two children
+TERMINAL = 2 # preterminal introduced for a terminal inside a longer rule
+
+# Arrays of a grammar bundle (see CompiledGrammar.save)
+GRAMMAR_ARRAYS = ['kinds', 'binary_lhs', 'binary_left', 'binary_right', 'binary_logprob', 'binary_groups', 'binary_lhs_unique',
+                  'unary_lhs', 'unary_child', 'unary_logprob', 'unary_groups', 'unary_lhs_unique']
+LEXICON_ARRAYS = ['preterminals', 'logprobs', 'offsets', 'dense']
+BUNDLE_VERSION = 1 # version of the layout of the grammar bundles, increased when the arrays change
+
+
+def _groups(lhs):
+    ''' Returns the start index of each group of equal (sorted) lhs ids '''
+    if not len(lhs):
+        return np.zeros(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, lhs[1:] != lhs[:-1]])
+
+def _max_by_lhs(scores, starts):
+    ''' Reduces axis 1 of scores (one row per rule, sorted by lhs)
+    to the best score and the index of the best rule for each lhs '''
+    best = np.maximum.reduceat(scores, starts, axis=1)
+    counts = np.diff(np.r_[starts, scores.shape[1]])
+    is_best = scores == np.repeat(best, counts, axis=1)
+    rule_ids = np.where(is_best, np.arange(scores.shape[1])[:, None], scores.shape[1])
+    argbest = np.minimum.reduceat(rule_ids, starts, axis=1)
+    return best, argbest
+
+def _log2(prob):
+    ''' Log base 2 of a rule probability, as NLTK uses for ProbabilisticTree '''
+    with np.errstate(divide='ignore'):
+        return float(np.log2(prob))
+
+def cell_index(n):
+    ''' Returns a (n+1, n+1) array with the chart cell of each span (i, j),
+    where the cells are ordered by span length '''
+    cell = np.full((n+1, n+1), -1, dtype=np.intp)
+    c = 0
+    for length in range(1, n+1):
+        for i in range(0, n-length+1):
+            cell[i, i+length] = c
+            c += 1
+    return cell
+
+
+class SpanSchedule:
+    ''' The loop over the spans of the CKY chart of messages of length n, computed once per length:
+    for each span length (from 2) the start positions of the spans, their cells and the cells
+    of their left and right children for each split point (arrays of shape (spans, splits)) '''
+
+    def __init__(self, n):
+        self.n = n
+        self.cell = cell_index(n)
+        self.cells = n*(n+1)//2
+        self.lengths = []
+        for length in range(2, n+1):
+            starts = np.arange(0, n-length+1)
+            ks = starts[:, None] + np.arange(1, length)[None, :] # split points (S, K)
+            self.lengths.append((length, starts, self.cell[starts, starts+length],
+                                 self.cell[starts[:, None], ks], self.cell[ks, (starts+length)[:, None]]))
+
+
+class Lexicon:
+    ''' Index from each terminal id to the ids of its preterminals and
+    their log2 probabilities, stored as CSR arrays:
+    the preterminals of terminal t are preterminals[offsets[t]:offsets[t+1]].
+    The dense (terminals, symbols) matrix allows looking up the lexical
+    chart cells of a whole batch of messages with a single gather. '''
+
+    def __init__(self, terminals, entries, symbol_count):
+        self.terminals = list(terminals)
+        self.index = {term: i for i, term in enumerate(self.terminals)}
+        entries = sorted(entries, key=lambda e: e[1])
+        terms = np.array([e[1] for e in entries], dtype=np.intp)
+        self.preterminals = np.array([e[0] for e in entries], dtype=np.intp)
+        self.logprobs = np.array([e[2] for e in entries], dtype=float)
+        self.offsets = np.searchsorted(terms, np.arange(len(self.terminals)+1))
+
+        self.dense = np.full((len(self.terminals), symbol_count), -np.inf)
+        np.maximum.at(self.dense, (terms, self.preterminals), self.logprobs)
+
+    @classmethod
+    def from_arrays(cls, terminals, arrays):
+        ''' Returns the lexicon of the terminals with the (LEXICON_ARRAYS) arrays '''
+        lexicon = cls.__new__(cls)
+        lexicon.terminals = list(terminals)
+        lexicon.index = {term: i for i, term in enumerate(lexicon.terminals)}
+        for name in LEXICON_ARRAYS:
+            setattr(lexicon, name, arrays[name])
+        return lexicon
+
+    def __len__(self):
+        return len(self.terminals)
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def lookup(self, term):
+        ''' Returns the preterminal ids and log2 probabilities of a terminal id '''
+        entries = slice(self.offsets[term], self.offsets[term+1])
+        return self.preterminals[entries], self.logprobs[entries]
+
+    def entry_terminals(self):
+        ''' Returns the terminal id of each entry '''
+        return np.repeat(np.arange(len(self.terminals)), np.diff(self.offsets))
+
+    def covers(self, tokens):
+        ''' Whether all tokens are terminals of the grammar '''
+        return all(tok in self.index for tok in tokens)
+
+    def encode(self, tokens):
+        ''' Returns the terminal ids of the tokens, raises a ValueError
+        if the grammar does not cover all tokens (like NLTK does) '''
+        missing = [tok for tok in tokens if tok not in self.index]
+        if missing:
+            missing = ", ".join(f"{w!r}" for w in missing)
+            raise ValueError("Grammar does not cover some of the " "input words: %r." % missing)
+        return [self.index[tok] for tok in tokens]
+
+    def encode_fixed(self, sents, n):
+        ''' Returns the terminal ids of sentences of length n as one (sentences, n) array,
+        with -1 for the tokens that are not terminals of the grammar.
+        Raises a ValueError if not all sentences have length n '''
+        wrong = sum(len(sent) != n for sent in sents)
+        if wrong:
+            raise ValueError(f"{wrong} of {len(sents)} messages do not have length {n}")
+        index = self.index
+        ids = np.fromiter((index.get(tok, -1) for sent in sents for tok in sent), dtype=np.intp, count=len(sents)*n)
+        return ids.reshape(len(sents), n)
+
+
+class CompiledGrammar:
+    ''' Binarized array representation of an NLTK PCFG.
+    Rules with more than two children are binarized right-branching;
+    the intermediate symbols are shared between rules with the same suffix.
+    Terminals inside such rules get their own preterminal with probability 1.
+    All log probabilities are in base 2. '''
+
+    def __init__(self, pcfg):
+        self.start = pcfg.start()
+        self.symbols = [] # Nonterminal or tuple key for introduced symbols
+        self.symbol_index = {}
+        self.kinds = []
+        self._terminals = []
+        self._terminal_index = {}
+        self._lexical = []
+        self._binary = []
+        self._unary = []
+
+        for prod in pcfg.productions():
+            lhs = self._symbol(prod.lhs())
+            rhs = prod.rhs()
+            logprob = _log2(prod.prob())
+            if len(rhs) == 1:
+                if isinstance(rhs[0], Nonterminal):
+                    self._unary.append((lhs, self._symbol(rhs[0]), logprob))
+                else:
+                    self._lexical.append((lhs, self._terminal(rhs[0]), logprob))
+            elif len(rhs) > 1:
+                children = [self._child(x) for x in rhs]
+                right = children[1] if len(children) == 2 else self._sequence(children[1:])
+                self._binary.append((lhs, children[0], right, logprob))
+
+        self.kinds = np.array(self.kinds, dtype=np.int8)
+        self.labels = [s.symbol() if k == ORIGINAL else None for s, k in zip(self.symbols, self.kinds)]
+        self.start_index = self.symbol_index[self.start]
+
+        self.lexicon = Lexicon(self._terminals, self._lexical, len(self.symbols))
+
+        # Binary and unary rules sorted by lhs
+        binary = sorted(self._binary, key=lambda r: r[0])
+        self.binary_lhs = np.array([r[0] for r in binary], dtype=np.intp)
+        self.binary_left = np.array([r[1] for r in binary], dtype=np.intp)
+        self.binary_right = np.array([r[2] for r in binary], dtype=np.intp)
+        self.binary_logprob = np.array([r[3] for r in binary], dtype=float)
+        self.binary_groups = _groups(self.binary_lhs)
+        self.binary_lhs_unique = self.binary_lhs[self.binary_groups]
+
+        unary = sorted(self._unary, key=lambda r: r[0])
+        self.unary_lhs = np.array([r[0] for r in unary], dtype=np.intp)
+        self.unary_child = np.array([r[1] for r in unary], dtype=np.intp)
+        self.unary_logprob = np.array([r[2] for r in unary], dtype=float)
+        self.unary_groups = _groups(self.unary_lhs)
+        self.unary_lhs_unique = self.unary_lhs[self.unary_groups]
+
+        del self._terminals, self._terminal_index, self._lexical, self._binary, self._unary
+
+    def save(self, directory):
+        ''' Saves the grammar as a bundle: a directory with an .npy file per array
+        and the labels of the symbols and the terminals (and the BUNDLE_VERSION) in symbols.json '''
+        os.makedirs(directory, exist_ok=True)
+        for name in GRAMMAR_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        for name in LEXICON_ARRAYS:
+            np.save(os.path.join(directory, f"lexicon_{name}.npy"), getattr(self.lexicon, name))
+        with open(os.path.join(directory, "symbols.json"), 'w') as f:
+            json.dump({'version': BUNDLE_VERSION, 'start_index': self.start_index, 'labels': self.labels, 'terminals': self.terminals}, f)
+
+    @staticmethod
+    def bundle_version(directory):
+        ''' Returns the BUNDLE_VERSION of the bundle saved in directory, or None if there is no bundle '''
+        try:
+            with open(os.path.join(directory, "symbols.json"), 'r') as f:
+                return json.load(f).get('version')
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        '''
+        Loads a grammar bundle saved with save. With mmap_mode 'r' (default), the arrays are memory-mapped
+        read-only instead of read into memory, such that all processes loading the bundle share them.
+        The introduced symbols are only identified by their kind and id.
+        Raises a ValueError for a bundle saved with another BUNDLE_VERSION.
+        '''
+        def array(name):
+            return np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode))
+
+        with open(os.path.join(directory, "symbols.json"), 'r') as f:
+            symbols = json.load(f)
+        if symbols.get('version') != BUNDLE_VERSION:
+            raise ValueError(f"The grammar bundle {directory} has version {symbols.get('version')} instead of {BUNDLE_VERSION}, save it again")
+        grammar = cls.__new__(cls)
+        for name in GRAMMAR_ARRAYS:
+            setattr(grammar, name, array(name))
+        grammar.labels = symbols['labels']
+        grammar.symbols = [Nonterminal(label) if kind == ORIGINAL else (int(kind), i)
+                           for i, (label, kind) in enumerate(zip(grammar.labels, grammar.kinds))]
+        grammar.symbol_index = {symbol: i for i, symbol in enumerate(grammar.symbols)}
+        grammar.start_index = symbols['start_index']
+        grammar.start = grammar.symbols[grammar.start_index]
+        grammar.lexicon = Lexicon.from_arrays(symbols['terminals'], {name: array(f"lexicon_{name}") for name in LEXICON_ARRAYS})
+        return grammar
+
+    def _symbol(self, key, kind=ORIGINAL):
+        if key not in self.symbol_index:
+            self.symbol_index[key] = len(self.symbols)
+            self.symbols.append(key)
+            self.kinds.append(kind)
+        return self.symbol_index[key]
+
+    def _terminal(self, term):
+        if term not in self._terminal_index:
+            self._terminal_index[term] = len(self._terminals)
+            self._terminals.append(term)
+        return self._terminal_index[term]
+
+    def _child(self, x):
+        ''' Symbol id of a child; terminals get a preterminal of their own '''
+        if isinstance(x, Nonterminal):
+            return self._symbol(x)
+        key = ('#', x)
+        if key not in self.symbol_index:
+            self._lexical.append((self._symbol(key, TERMINAL), self._terminal(x), 0.0))
+        return self.symbol_index[key]
+
+    def _sequence(self, children):
+        ''' Symbol id deriving the sequence of children, adding its rules once '''
+        key = ('@',) + tuple(children)
+        if key not in self.symbol_index:
+            idx = self._symbol(key, SEQUENCE)
+            right = children[1] if len(children) == 2 else self._sequence(children[1:])
+            self._binary.append((idx, children[0], right, 0.0))
+        return self.symbol_index[key]
+
+    @property
+    def nonterminal_count(self):
+        return len(self.symbols)
+
+    @property
+    def rule_count(self):
+        return len(self.binary_lhs) + len(self.unary_lhs)
+
+    @property
+    def terminals(self):
+        return self.lexicon.terminals
+
+    def word_classes(self):
+        ''' Returns dictionaries with the list of terminals of each preterminal
+        of the PCFG and the list of preterminals of each terminal '''
+        preterminals = {}
+        terminals = {}
+        original = self.kinds[self.lexicon.preterminals] == ORIGINAL
+        for term, pt in zip(self.lexicon.entry_terminals()[original], self.lexicon.preterminals[original]):
+            term = self.lexicon.terminals[term]
+            preterminals.setdefault(self.labels[pt], []).append(term)
+            terminals.setdefault(term, []).append(self.labels[pt])
+        return preterminals, terminals
+
+
+class CKYViterbiParser(ParserI):
+    ''' Viterbi parser over a CompiledGrammar, returning the same
+    ProbabilisticTrees as nltk's ViterbiParser.
+    Messages of the same length are parsed together in batches.
+
+    If beam_width and/or beam_threshold are set, each chart cell only keeps
+    the beam_width most probable nonterminals and/or the nonterminals whose
+    log2 probability is within beam_threshold of the best one in the cell.
+    The resulting parses are approximate: a message may get a less probable
+    parse than the Viterbi parse, or no parse at all. '''
+
+    def __init__(self, grammar, beam_width=None, beam_threshold=None, batch_size=64):
+        self._grammar = grammar
+        if beam_width is not None and beam_width <= 0:
+            raise ValueError(f"beam_width must be positive, got {beam_width}")
+        if beam_threshold is not None and beam_threshold < 0:
+            raise ValueError(f"beam_threshold must not be negative, got {beam_threshold}")
+        self._compiled = grammar if isinstance(grammar, CompiledGrammar) else CompiledGrammar(grammar)
+        self.beam_width = beam_width
+        self.beam_threshold = beam_threshold
+        self.batch_size = batch_size
+        # Span schedule per message length and the chart arrays of the last batch shape,
+        # which are reused by the following batches of the same shape
+        self._schedules = {}
+        self._buffers = None
+        # Counters for instrumentation
+        self.messages_parsed = 0
+        self.cells_filled = 0
+
+    def grammar(self):
+        return self._grammar
+
+    @property
+    def compiled(self):
+        return self._compiled
+
+    @property
+    def pruned(self):
+        return self.beam_width is not None or self.beam_threshold is not None
+
+    def parse(self, tokens):
+        tokens = list(tokens)
+        tree = self._parse_batch([tokens])[0] if tokens else None
+        if tree is not None:
+            yield tree
+
+    def parse_sents(self, sents, progress=None):
+        ''' Parses the sentences in batches of equal length,
+        returns an iterator over the parses of each sentence.
+        If given, progress (an instrument.Progress) is updated after each batch '''
+        sents = [list(s) for s in sents]
+        results = [None] * len(sents)
+        by_length = {}
+        for idx, sent in enumerate(sents):
+            if sent:
+                by_length.setdefault(len(sent), []).append(idx)
+        for n, idxs in by_length.items():
+            for b in range(0, len(idxs), self.batch_size):
+                batch = idxs[b:b+self.batch_size]
+                trees = self._parse_batch([sents[i] for i in batch])
+                for idx, tree in zip(batch, trees):
+                    results[idx] = tree
+                if progress is not None:
+                    progress.update(len(batch), success=sum(tree is not None for tree in trees))
+        return (iter([] if tree is None else [tree]) for tree in results)
+
+    def parse_ids(self, ids, progress=None):
+        ''' Parses the sentences of a (sentences, n) array of terminal ids (e.g. of Lexicon.encode_fixed,
+        all covered by the grammar) in batches, reusing the same chart arrays for all batches.
+        Returns a list with the Viterbi tree (or None) of each sentence.
+        If given, progress (an instrument.Progress) is updated after each batch '''
+        terminals = self._compiled.terminals
+        trees = []
+        for b in range(0, len(ids), self.batch_size):
+            batch = ids[b:b+self.batch_size]
+            batch_trees = self._parse_ids(batch, [[terminals[t] for t in row] for row in batch])
+            trees.extend(batch_trees)
+            if progress is not None:
+                progress.update(len(batch), success=sum(tree is not None for tree in batch_trees))
+        return trees
+
+    def logprob_ids(self, ids):
+        ''' Returns an array with the log2 probability of the Viterbi parse (-inf if none)
+        of each sentence of a (sentences, n) array of terminal ids, without building the trees '''
+        g = self._compiled
+        logprobs = np.full(len(ids), -np.inf)
+        for b in range(0, len(ids), self.batch_size):
+            batch = ids[b:b+self.batch_size]
+            chart, _, _, cell = self._viterbi(batch, backpointers=False)
+            self.messages_parsed += len(batch)
+            self.cells_filled += len(batch) * chart.shape[0]
+            logprobs[b:b+len(batch)] = chart[cell[0, ids.shape[1]], g.start_index]
+        return logprobs
+
+    def logprob_sents(self, sents):
+        ''' Returns an array with the log2 probability of the Viterbi parse of each sentence
+        (-inf if it cannot be parsed, also if the grammar does not cover all its words),
+        without building the trees '''
+        g = self._compiled
+        sents = [list(s) for s in sents]
+        logprobs = np.full(len(sents), -np.inf)
+        by_length = {}
+        for idx, sent in enumerate(sents):
+            if sent and g.lexicon.covers(sent):
+                by_length.setdefault(len(sent), []).append(idx)
+        for n, idxs in by_length.items():
+            ids = np.array([g.lexicon.encode(sents[i]) for i in idxs], dtype=np.intp)
+            logprobs[idxs] = self.logprob_ids(ids)
+        return logprobs
+
+    def _parse_batch(self, sents):
+        ''' Returns the Viterbi tree (or None) of each sentence of equal length '''
+        ids = np.array([self._compiled.lexicon.encode(sent) for sent in sents], dtype=np.intp)
+        return self._parse_ids(ids, sents)
+
+    def _parse_ids(self, ids, sents):
+        ''' Returns the Viterbi tree (or None) of each sentence of a (batch, n) array of terminal ids '''
+        g = self._compiled
+        chart, rule, split, cell = self._viterbi(ids)
+        n = ids.shape[1]
+        self.messages_parsed += len(sents)
+        self.cells_filled += len(sents) * chart.shape[0]
+        root = cell[0, n]
+        trees = []
+        for b, sent in enumerate(sents):
+            if np.isfinite(chart[root, g.start_index, b]):
+                trees.append(self._build(b, 0, n, g.start_index, sent, chart, rule, split, cell)[0])
+            else:
+                trees.append(None)
+        return trees
+
+    def _viterbi(self, ids, backpointers=True):
+        ''' Fills the chart for a (batch, n) array of terminal ids.
+        Returns the log2 probabilities, rule and split backpointers of each
+        (cell, symbol, message) and the cell index of each span.
+        Without backpointers, only the log2 probabilities are computed (the returned
+        backpointer arrays are not filled), which suffices to recognise the messages.
+        The messages are the last axis, such that gathering the rules
+        of a cell reads contiguous memory.
+        The returned arrays are reused (overwritten) by the next batch of the same shape. '''
+        g = self._compiled
+        B, n = ids.shape
+        if n not in self._schedules:
+            self._schedules[n] = SpanSchedule(n)
+        schedule = self._schedules[n]
+        cell = schedule.cell
+        chart, rule, split, alive = self._chart_buffers(schedule.cells, B)
+
+        # Lexical layer: the cells of length 1 are the first n cells
+        out = np.arange(n)
+        chart[out] = g.lexicon.dense[ids].transpose(1, 2, 0)
+        if backpointers:
+            rule[out] = np.where(np.isfinite(chart[out]), LEXICAL, NO_RULE)
+        self._unary_closure(chart, rule if backpointers else None, out)
+        if n > 1:
+            self._prune(chart, out)
+        alive[out] = np.isfinite(chart[out]).any(axis=2)
+
+        for length, starts, out, left, right in schedule.lengths:
+            # Only the rules of which both children occur in the child cells can apply
+            alive_left = alive[left.ravel()].any(axis=0)
+            alive_right = alive[right.ravel()].any(axis=0)
+            active = np.flatnonzero(alive_left[g.binary_left] & alive_right[g.binary_right])
+            if len(active):
+                groups = _groups(g.binary_lhs[active])
+                lhs = g.binary_lhs[active][groups]
+                # best score of each rule over the split points: (S, R, B)
+                rule_left = g.binary_left[active]
+                rule_right = g.binary_right[active]
+                rule_scores = None
+                for k in range(length-1):
+                    scores = chart[left[:, k, None], rule_left] + chart[right[:, k, None], rule_right]
+                    if rule_scores is None:
+                        rule_scores = scores
+                        best_k = np.zeros(scores.shape, dtype=np.int16) if backpointers else None
+                    elif backpointers:
+                        better = scores > rule_scores
+                        np.copyto(rule_scores, scores, where=better)
+                        best_k[better] = k
+                    else:
+                        np.maximum(rule_scores, scores, out=rule_scores)
+                rule_scores += g.binary_logprob[active][:, None]
+                if backpointers:
+                    best, argbest = _max_by_lhs(rule_scores, groups)
+                    best_split = np.take_along_axis(best_k, argbest, axis=1) + starts[:, None, None] + 1
+                    rule[out[:, None], lhs] = np.where(np.isfinite(best), active[argbest], NO_RULE)
+                    split[out[:, None], lhs] = best_split
+                else:
+                    best = np.maximum.reduceat(rule_scores, groups, axis=1)
+                chart[out[:, None], lhs] = best
+            self._unary_closure(chart, rule if backpointers else None, out)
+            if length < n:
+                self._prune(chart, out)
+            alive[out] = np.isfinite(chart[out]).any(axis=2)
+        return chart, rule, split, cell
+
+    def _chart_buffers(self, cells, B):
+        ''' Returns the (reset) chart arrays for a batch of B messages with this number of cells,
+        allocated only if the shape differs from the previous batch '''
+        g = self._compiled
+        if self._buffers is None or self._buffers[0].shape != (cells, g.nonterminal_count, B):
+            self._buffers = (np.empty((cells, g.nonterminal_count, B)),
+                             # Backpointers are only read for symbols with a finite log probability
+                             np.empty((cells, g.nonterminal_count, B), dtype=np.int32),
+                             np.empty((cells, g.nonterminal_count, B), dtype=np.int16),
+                             np.empty((cells, g.nonterminal_count), dtype=bool)) # symbol found in cell for any message
+        chart, rule, split, alive = self._buffers
+        chart.fill(-np.inf)
+        alive.fill(False)
+        return chart, rule, split, alive
+
+    def _unary_closure(self, chart, rule, out):
+        ''' Applies the unary rules to the cells until no parse improves
+        (updating the rule backpointers unless rule is None) '''
+        g = self._compiled
+        if not len(g.unary_lhs):
+            return
+        lhs = g.unary_lhs_unique
+        for _ in range(g.nonterminal_count):
+            scores = chart[out[:, None], g.unary_child] + g.unary_logprob[:, None]
+            if rule is None:
+                best = np.maximum.reduceat(scores, g.unary_groups, axis=1)
+            else:
+                best, argbest = _max_by_lhs(scores, g.unary_groups)
+            current = chart[out[:, None], lhs]
+            better = best > current
+            if not better.any():
+                break
+            chart[out[:, None], lhs] = np.where(better, best, current)
+            if rule is not None:
+                rule[out[:, None], lhs] = np.where(better, len(g.binary_lhs) + argbest, rule[out[:, None], lhs])
+
+    def _prune(self, chart, out):
+        ''' Removes the symbols outside the beam from the cells '''
+        if not self.pruned:
+            return
+        scores = chart[out]
+        keep = np.isfinite(scores)
+        if self.beam_threshold is not None:
+            keep &= scores >= scores.max(axis=1, keepdims=True) - self.beam_threshold
+        if self.beam_width is not None and self.beam_width < scores.shape[1]:
+            top = np.argpartition(-scores, self.beam_width-1, axis=1)[:, :self.beam_width]
+            in_beam = np.zeros_like(keep)
+            np.put_along_axis(in_beam, top, True, axis=1)
+            keep &= in_beam
+        chart[out] = np.where(keep, scores, -np.inf)
+
+    def _build(self, b, i, j, sym, tokens, chart, rule, split, cell):
+        ''' Returns the list of children that symbol sym contributes to the tree
+        of message b over span (i, j); introduced symbols are spliced out '''
+        g = self._compiled
+        c = cell[i, j]
+        r = rule[c, sym, b]
+        if r == LEXICAL:
+            children = [tokens[i]]
+        elif r >= len(g.binary_lhs):
+            children = self._build(b, i, j, g.unary_child[r-len(g.binary_lhs)], tokens, chart, rule, split, cell)
+        else:
+            k = split[c, sym, b]
+            children = (self._build(b, i, k, g.binary_left[r], tokens, chart, rule, split, cell)
+                        + self._build(b, k, j, g.binary_right[r], tokens, chart, rule, split, cell))
+        if g.kinds[sym] != ORIGINAL:
+            return children
+        return [ProbabilisticTree(g.labels[sym], children, logprob=float(chart[c, sym, b]))]
@@ -0,0 +1,203 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+from cky import BUNDLE_VERSION, CompiledGrammar, CKYViterbiParser
+from analysis import read_grammar, compile_grammar, load_messages, positive_int, non_negative_float
+import instrument
+
+'''
+Compares the grammars induced from several languages (e.g. the seeds of a language and its
+struct/rand/shuf baselines), loaded once from a grammar directory (e.g. results/grammars/ccl/):
+- cross-coverage: the percentage of the messages of language A (data/<A>.txt, with A the name
+  of its grammar <A>.pcfg) that can be parsed by the grammar of language B;
+- class alignment: the preterminal classes of each pair of grammars matched one-to-one
+  by the overlap (Jaccard index) of their words.
+The grammars are compiled once and exported as bundles of .npy files (see CompiledGrammar.save),
+which the worker processes load memory-mapped, such that all workers share one copy of the rule arrays
+and lexicon in the page cache. The workers parse the (unique) messages of all languages with each
+grammar in chunks and reuse their parser of a grammar.
+
+Example usage:
+    python utils/compare_grammars.py --grammars results/grammars/ccl --data data --output results/comparison/ccl --workers 8
+'''
+
+CHUNK_SIZE = 5000 # messages per task of the worker pool
+
+_worker = {}
+
+def class_alignment(grammar_a, grammar_b):
+    '''
+    Matches the preterminal classes of grammar_a to those of grammar_b one-to-one,
+    greedily by decreasing Jaccard index of their sets of words (pairs without common words are not matched).
+    Returns the list of matches (class of a, class of b, Jaccard index) and the alignment score:
+    the sum of the Jaccard indices of the matches divided by the largest number of classes (1 for equal classes).
+    '''
+    classes_a, _ = grammar_a.word_classes()
+    classes_b, _ = grammar_b.word_classes()
+    if not classes_a or not classes_b:
+        return [], 0.0
+    words = {w: i for i, w in enumerate(sorted({w for ws in list(classes_a.values()) + list(classes_b.values()) for w in ws}))}
+
+    def incidence(classes):
+        matrix = np.zeros((len(classes), len(words)))
+        for c, ws in enumerate(classes.values()):
+            matrix[c, [words[w] for w in ws]] = 1
+        return matrix
+
+    A, B = incidence(classes_a), incidence(classes_b)
+    intersection = A @ B.T
+    union = A.sum(axis=1)[:, None] + B.sum(axis=1)[None, :] - intersection
+    jaccard = intersection / union
+    labels_a, labels_b = list(classes_a), list(classes_b)
+    matches = []
+    used_a, used_b = set(), set()
+    for flat in np.argsort(-jaccard, axis=None, kind='stable'):
+        a, b = np.unravel_index(flat, jaccard.shape)
+        if jaccard[a, b] == 0:
+            break
+        if a not in used_a and b not in used_b:
+            used_a.add(a)
+            used_b.add(b)
+            matches.append((labels_a[a], labels_b[b], float(jaccard[a, b])))
+    return matches, sum(j for _, _, j in matches) / max(len(labels_a), len(labels_b))
+
+def export_grammars(files, bundle_dir):
+    '''
+    Compiles each grammar file and saves it as a bundle in bundle_dir/<name>_<hash of the grammar>,
+    unless that bundle exists with the current BUNDLE_VERSION. Returns the list of bundle directories.
+    '''
+    bundles = []
+    for f in files:
+        with open(f, 'rb') as grammar_file:
+            digest = hashlib.sha256(grammar_file.read()).hexdigest()[:16]
+        bundle = os.path.join(bundle_dir, f"{os.path.splitext(os.path.basename(f))[0]}_{digest}")
+        if CompiledGrammar.bundle_version(bundle) != BUNDLE_VERSION:
+            compile_grammar(read_grammar(f)).save(bundle)
+        bundles.append(bundle)
+    return bundles
+
+def _init_worker(bundles, messages, beam_width, beam_threshold):
+    ''' Keeps the grammar bundles and the messages in the worker process '''
+    _worker['bundles'] = bundles
+    _worker['messages'] = messages
+    _worker['beam'] = (beam_width, beam_threshold)
+    _worker['parsers'] = {}
+
+def _parse_chunk(task):
+    ''' Returns which messages start:end can be parsed by grammar g (loaded on its first chunk) '''
+    g, start, end = task
+    parsers = _worker['parsers']
+    if g not in parsers:
+        parsers[g] = CKYViterbiParser(CompiledGrammar.load(_worker['bundles'][g]), *_worker['beam'])
+    return g, start, np.isfinite(parsers[g].logprob_sents(_worker['messages'][start:end]))
+
+def cross_coverage(bundles, languages, workers=1, beam_width=None, beam_threshold=None, chunk_size=CHUNK_SIZE):
+    '''
+    Returns the (languages, grammars) matrix with the percentage of the messages of each language
+    (a list of messages, counting duplicates) that can be parsed by each grammar (bundle, see export_grammars).
+    The unique messages of all languages are parsed once by each grammar, with workers processes.
+    '''
+    index = {}
+    rows = [np.array([index.setdefault(m, len(index)) for m in messages], dtype=np.intp) for messages in languages]
+    messages = list(index)
+    tasks = [(g, start, min(start + chunk_size, len(messages)))
+             for g in range(len(bundles)) for start in range(0, len(messages), chunk_size)]
+
+    parsed = np.zeros((len(bundles), len(messages)), dtype=bool)
+    progress = instrument.Progress("Cross-coverage", len(bundles) * len(messages))
+    initargs = (bundles, messages, beam_width, beam_threshold)
+    if workers > 1:
+        with Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            results = pool.imap_unordered(_parse_chunk, tasks)
+            for g, start, chunk in results:
+                parsed[g, start:start+len(chunk)] = chunk
+                progress.update(len(chunk), success=int(chunk.sum()))
+    else:
+        _init_worker(*initargs)
+        for task in tasks:
+            g, start, chunk = _parse_chunk(task)
+            parsed[g, start:start+len(chunk)] = chunk
+            progress.update(len(chunk), success=int(chunk.sum()))
+    progress.finish()
+
+    coverage = np.full((len(languages), len(bundles)), np.nan)
+    for l, row in enumerate(rows):
+        if len(row):
+            coverage[l] = parsed[:, row].mean(axis=1) * 100
+    return coverage
+
+def write_matrix(filename, matrix, row_names, column_names):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([''] + column_names)
+        for name, row in zip(row_names, matrix):
+            writer.writerow([name] + [float(v) for v in row])
+
+def main(args):
+    if args.bundle_dir:
+        compare(args, args.bundle_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="grammars") as bundle_dir:
+            compare(args, bundle_dir)
+
+def compare(args, bundle_dir):
+    files = sorted(glob.glob(os.path.join(args.grammars, "*.pcfg")))
+    names = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    logging.info(f"Comparing {len(files)} grammars from {args.grammars}")
+    with instrument.stage('load_grammars', grammars=len(files)) as record:
+        bundles = export_grammars(files, bundle_dir)
+        grammars = [CompiledGrammar.load(b) for b in bundles]
+        record['rules'] = sum(g.rule_count for g in grammars)
+
+    # The languages are the grammars of which the messages are found
+    languages = [n for n in names if os.path.isfile(os.path.join(args.data, f"{n}.txt"))]
+    for n in sorted(set(names) - set(languages)):
+        logging.warning(f"No messages found for grammar {n}, skipping it as language")
+    with instrument.stage('load_messages') as record:
+        messages = [load_messages(os.path.join(args.data, f"{n}.txt")) for n in languages]
+        record['messages'] = sum(len(m) for m in messages)
+
+    os.makedirs(args.output, exist_ok=True)
+    with instrument.stage('class_alignment', pairs=len(grammars)**2):
+        scores = np.zeros((len(grammars), len(grammars)))
+        matches = {}
+        for a, name_a in enumerate(names):
+            matches[name_a] = {}
+            for b, name_b in enumerate(names):
+                matches[name_a][name_b], scores[a, b] = class_alignment(grammars[a], grammars[b])
+    write_matrix(os.path.join(args.output, "class_alignment.csv"), scores, names, names)
+    with open(os.path.join(args.output, "class_alignment.json"), 'w') as f:
+        json.dump(matches, f, indent=1)
+
+    with instrument.stage('cross_coverage', workers=args.workers) as record:
+        coverage = cross_coverage(bundles, messages, args.workers, args.beam_width, args.beam_threshold)
+        record['messages'] = len(grammars) * sum(len(m) for m in messages)
+    write_matrix(os.path.join(args.output, "cross_coverage.csv"), coverage, languages, names)
+    print(f"Compared {len(grammars)} grammars on {len(languages)} languages, results in {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grammars', type=str, required=True, help="Directory with the grammars (.pcfg), e.g. results/grammars/ccl.")
+    parser.add_argument('--data', type=str, default="data", help="Directory with the messages of each grammar (<name>.txt for <name>.pcfg).")
+    parser.add_argument('--output', type=str, required=True, help="Directory for cross_coverage.csv (rows: languages, columns: grammars) and class_alignment.{csv,json}.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes for parsing.")
+    parser.add_argument('--beam_width', type=positive_int, default=None, help="Keep at most this many nonterminals per chart cell (approximate parses).")
+    parser.add_argument('--beam_threshold', type=non_negative_float, default=None, help="Keep the nonterminals within this log2 probability of the best one per chart cell (approximate parses).")
+    parser.add_argument('--bundle_dir', type=str, default=None, help="Directory to keep the compiled grammars in (reused for the same grammars), a temporary directory by default.")
+    parser.add_argument('--log_dir', type=str, default=None, help="Directory for the log and trace files.")
+    args = parser.parse_args()
+    if args.log_dir:
+        logging.basicConfig(filename=os.path.join(args.log_dir, "compare_grammars.log"),
+                            filemode='a',
+                            format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+                            datefmt='%H:%M:%S',
+                            level=logging.DEBUG)
+        instrument.start_trace(os.path.join(args.log_dir, "trace.jsonl"), script='compare_grammars')
+    main(args)
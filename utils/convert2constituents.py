@@ -1,58 +1,97 @@
-import numpy as np
-import pickle
 import argparse
 import os
 import re
-from nltk import Tree, ParentedTree
-from pprint import pprint
 import ast
+import logging
+import time
+import instrument
 
 '''
 This script is used for parsing the output constituency files of the CCL parser
 and writes to a file which can be read by BMM_labels.
+Several bracket files (e.g. of all languages and baselines) can be converted at once
+by a pool of worker processes, which writes a .txt/.span pair per bracket file to the output directory.
+
+Example usage:
+    python utils/convert2constituents.py --bracket_file results/ccl/V6L3s0.ccl --format ccl --shapes True --output results/bmm/V6L3s0
+    python utils/convert2constituents.py --bracket_file results/ccl/*.ccl --format ccl --shapes True --output_dir results/bmm --workers 8
 '''
 
+WORD_RE = re.compile(r'[^\s\(\)]+')
+DIGITS_RE = re.compile(r'\d+')
+NON_DIGIT_RE = re.compile(r'[^0-9]')
+TREE_TOKEN_RE = re.compile(r'\(|\)|[^\s\(\)]+')
+
 def main(config):
     # Parse the constituency trees of CCL to strings on one line
-    if config.format=='ccl':
-        trees = parse2list_ccl(config.bracket_file, config.shapes)
-    elif config.format=='diora':
-        trees = parse2list_diora(config.bracket_file, config.shapes)
-        text = parse2text_diora(config.bracket_file)
-    lines = []
-    # Go over each tree
-    for t in trees:
-        message = find_message(t, config.shapes)
-
-        line = []
-        # Read the string to an NLTK tree with the words swapped for indices
-        tree = replace_terminals_with_indices(t)
-        # Go over each sub tree and find the min and max index
-        # to find a constituent
-        for subtree in tree.subtrees():
-            idx = [int(x) for x in subtree.leaves()]
-            if idx:
-                line.append( f"{min(idx)}-{max(idx)+1}")
-        lines.append((message, " ".join(list(set(line)))))
+    with instrument.stage('read_brackets', format=config.format) as record:
+        if config.format=='ccl':
+            trees = parse2list_ccl(config.bracket_file, config.shapes)
+        elif config.format=='diora':
+            trees = parse2list_diora(config.bracket_file, config.shapes)
+            text = parse2text_diora(config.bracket_file)
+        record['messages'] = len(trees)
+    with instrument.stage('convert_trees', messages=len(trees)) as record:
+        lines = convert_trees(trees, config.shapes)
+        record['constituents'] = sum(len(line[1].split()) for line in lines)
     # Write the found constituent labels to a file
-    newline = ""
-    for i, line in enumerate(lines):
+    with instrument.stage('write_spans', messages=len(lines)):
         if not config.shapes:
             with open(f"{config.output}.txt",'a+') as f:
-                f.write(newline+line[0])
+                f.write("\n".join(line[0] for line in lines))
         elif config.format=='diora':
             with open(f"{config.output}.txt",'a+') as f:
-                f.write(newline+text[i])
+                f.write("\n".join(text[:len(lines)]))
         with open(f"{config.output}.span",'a+') as f:
-            span = remove_redundant_brackets( line[1] )
-            f.write(newline+span)
-        newline = "\n"
+            f.write("\n".join(remove_redundant_brackets(line[1]) for line in lines))
+    return len(lines)
+
+def _convert_file(config):
+    ''' Converts one bracket file (in a worker process), returns the file, number of trees and seconds '''
+    start = time.perf_counter()
+    with instrument.stage('convert_file', bracket_file=config.bracket_file) as record:
+        record['messages'] = messages = main(config)
+    return config.bracket_file, messages, time.perf_counter() - start
+
+def convert_files(bracket_files, output_dir, format='ccl', shapes=False, workers=1):
+    '''
+    Converts the bracket files with workers processes, writing <output_dir>/<name>.txt/.span
+    for each file <name>.<ext>. Logs the throughput of each file and returns a list with
+    the file, number of trees and seconds of each file (in order of completion).
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    configs = [argparse.Namespace(bracket_file=f, format=format, shapes=shapes,
+                                  output=os.path.join(output_dir, os.path.splitext(os.path.basename(f))[0]))
+               for f in bracket_files]
+    from multiprocessing import Pool
+    results = []
+    with Pool(min(workers, len(configs)) or 1) as pool:
+        for bracket_file, messages, seconds in pool.imap_unordered(_convert_file, configs):
+            logging.info(f"Converted {messages} trees of {bracket_file} in {seconds:.3f}s ({messages / seconds:.1f} trees/s)")
+            print(f"{bracket_file}: {messages} trees in {seconds:.3f}s ({messages / seconds:.1f} trees/s)")
+            results.append((bracket_file, messages, seconds))
+    return results
+
+def convert_trees(trees, shapes=False):
+    ''' Returns for each tree string (see parse2list_ccl) the message
+    and its constituents as spans of word indices (e.g. "0-2 2-3") '''
+    lines = []
+    progress = instrument.Progress("Converting trees", len(trees), unit="trees")
+    # Go over each tree
+    for t in trees:
+        message = find_message(t, shapes)
+
+        line = constituent_spans(t)
+        lines.append((message, " ".join(list(set(line)))))
+        progress.update(success=1)
+    progress.finish()
+    return lines
 
 def remove_redundant_brackets(span):
     ''' Removes the bracketing in the tree for 0-1 ... (n-1)-n once.
     Because extra brackets were added to read the tree properly in NLTK,
     these brackets need to be removed again '''
-    result = [e for e in re.split("[^0-9]", span) if e != '']
+    result = [e for e in NON_DIGIT_RE.split(span) if e != '']
     max_int =  max(map(int, result))
     span = span.split()
     newspan = []
@@ -65,26 +104,60 @@ def remove_redundant_brackets(span):
             newspan.append(j)
     return " ".join(newspan)
 
-def replace_terminals_with_indices(treestring):
-    ''' Replaces each terminal in the tree read from a string with an index in the sentence '''
-    tree = ParentedTree.fromstring(treestring)
-    for idx, _ in enumerate(tree.leaves()):
-        tree_location = tree.leaf_treeposition(idx)
-        non_terminal = tree[tree_location[:-1]]
-        non_terminal[0] = str(idx)
-    return tree
-    
+def constituent_spans(treestring):
+    ''' Returns the span (e.g. "0-2") of the words below each node of a tree string (see parse2list_ccl)
+    in preorder, like the subtrees of the tree read by NLTK; nodes without words are skipped.
+    The tree is read with a single tokenizer pass instead of building an NLTK tree '''
+    spans = []
+    stack = [] # (index in spans, first word) of the open nodes
+    position = 0 # number of words read
+    expect_label = False # the first token after an opening bracket is the label of the node
+    for token in TREE_TOKEN_RE.findall(treestring):
+        if token == '(':
+            stack.append((len(spans), position))
+            spans.append(None)
+            expect_label = True
+        elif token == ')':
+            index, first = stack.pop()
+            spans[index] = f"{first}-{position}" if position > first else None
+            expect_label = False
+        elif expect_label:
+            expect_label = False
+        else:
+            position += 1
+    return [span for span in spans if span is not None]
+
+def constituent_tree(treestring):
+    ''' Returns a tree string (see parse2list_ccl) as nested tuples of its words,
+    where nodes with a single child are replaced by their child '''
+    stack = [[]]
+    expect_label = False
+    for token in TREE_TOKEN_RE.findall(treestring):
+        if token == '(':
+            stack.append([])
+            expect_label = True
+        elif token == ')':
+            children = stack.pop()
+            if children:
+                stack[-1].append(children[0] if len(children) == 1 else tuple(children))
+            expect_label = False
+        elif expect_label:
+            expect_label = False
+        else:
+            stack[-1].append(token.strip("'"))
+    return stack[0][0] if len(stack[0]) == 1 else tuple(stack[0])
+
 def find_message(tree, shapes=False):
     ''' Find the message in plain text from the tree '''
     if not shapes:
-        return " ".join(re.findall(r'\d+', tree))+" ."
+        return " ".join(DIGITS_RE.findall(tree))+" ."
     else:
-        return " ".join(re.findall(r'[^\s\(\)]+', tree))+" ."
+        return " ".join(WORD_RE.findall(tree))+" ."
 
-def give_brackets(match):
+def give_brackets(tree):
     ''' Give an extra bracketing for each terminal and a label
     to avoid problems with parsing the string with NLTK '''
-    return f"(L {match.group(0)})"
+    return WORD_RE.sub(r"(L \g<0>)", tree)
 
 def flatten(container):
     ''' Flatten a list '''
@@ -120,8 +193,7 @@ def parse2list_diora(parse_path, shapes):
         tree = tree.replace("[","(")
         tree = tree.replace("]",")")
         tree = tree.replace(',', '')
-        tree = re.sub(r'[^\s\(\)]+', give_brackets, tree)
-        trees.append(tree)
+        trees.append(give_brackets(tree))
     return trees
 
 def parse2list_ccl(parse_path, shapes=False):
@@ -149,19 +221,33 @@ def parse2list_ccl(parse_path, shapes=False):
             tree = tree.replace(" (","(")
             tree = tree.replace(") ",")")
             if not tree=='':
-                if not shapes:
-                    tree = re.sub(r'[^\s\(\)]+', give_brackets, tree)
-                else:
-                    tree = re.sub(r'[^\s\(\)]+', give_brackets, tree)
-                trees.append(tree)
+                trees.append(give_brackets(tree))
             tree = ""
     return trees            
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('--bracket_file', type=str, required=True, help="Path to parsed sentences (bracketing).")
+    parser.add_argument('--bracket_file', type=str, nargs='+', required=True, help="Path(s) to parsed sentences (bracketing); several files are converted in parallel (see --output_dir).")
     parser.add_argument('--format', type=str, required=True, help="Format the corpus should be in. Options are <ccl>, <diora>")
     parser.add_argument('--shapes', type=bool, default=False, help="Whether we run on shapes/natural language.")
-    parser.add_argument('--output', type=str, required=True, help="Output filepath without extension.")
+    parser.add_argument('--output', type=str, default=None, help="Output filepath without extension (for a single bracket file).")
+    parser.add_argument('--output_dir', type=str, default=None, help="Output directory for several bracket files; <name>.<ext> is written to <name>.txt/.span.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes for converting several bracket files.")
+    parser.add_argument('--log_dir', type=str, default=None, help="Directory to append the trace of the stages (trace.jsonl) to.")
     config = parser.parse_args()
-    main(config)
+    if config.output_dir is None and (config.output is None or len(config.bracket_file) > 1):
+        parser.error("--output is required for a single bracket file and --output_dir for several bracket files")
+    name = os.path.basename(config.output) if config.output_dir is None else "batch"
+    if config.log_dir:
+        logging.basicConfig(filename=config.log_dir+f"/{name}_convert2constituents.log",
+                            filemode='a',
+                            format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+                            datefmt='%H:%M:%S',
+                            level=logging.DEBUG)
+        instrument.start_trace(config.log_dir+"/trace.jsonl", script='convert2constituents',
+                               name=name, format=config.format)
+    if config.output_dir is None:
+        config.bracket_file = config.bracket_file[0]
+        main(config)
+    else:
+        convert_files(config.bracket_file, config.output_dir, config.format, config.shapes, config.workers)
@@ -0,0 +1,107 @@
+import argparse
+import logging
+import os
+import time
+import numpy as np
+
+'''
+Trains GloVe word vectors (Pennington et al., 2014) for the DIORA constituency parser.
+Replaces the GloVe binaries of scripts/run_glove.sh (vocab_count, cooccur, shuffle and glove):
+for the small vocabularies of the emergent languages, the co-occurrence matrix is counted
+in memory and the vectors are fitted with full-batch AdaGrad.
+The vectors are written in the text format of GloVe to <output>/vectors<name>.txt.
+
+Example usage:
+    python utils/glove.py --corpus data/demo_language.txt --output results/glove --name demo_language
+'''
+
+def build_vocab(messages, min_count=5):
+    ''' Returns the words occurring at least min_count times,
+    sorted by decreasing count and alphabetically for ties (like GloVe's vocab_count) '''
+    words, counts = np.unique([w for m in messages for w in m], return_counts=True)
+    order = sorted(range(len(words)), key=lambda i: (-counts[i], words[i]))
+    return [str(words[i]) for i in order if counts[i] >= min_count]
+
+def cooccurrence_matrix(messages, vocab, window_size=15):
+    ''' Returns the dense co-occurrence matrix of the vocabulary within each message,
+    where a word pair at distance d counts 1/d (like GloVe's cooccur with a symmetric window).
+    Out-of-vocabulary words are skipped '''
+    index = {w: i for i, w in enumerate(vocab)}
+    V = len(vocab)
+    # Messages of equal length (after skipping words) are counted at once
+    by_length = {}
+    for m in messages:
+        ids = [index[w] for w in m if w in index]
+        by_length.setdefault(len(ids), []).append(ids)
+    X = np.zeros(V * V)
+    for n, ids in by_length.items():
+        if n < 2:
+            continue # no pairs (e.g. blank messages or all words out of the vocabulary)
+        ids = np.array(ids, dtype=np.intp).reshape(-1, n)
+        for d in range(1, min(window_size, n-1) + 1):
+            X += np.bincount((ids[:, :-d] * V + ids[:, d:]).ravel(), minlength=V*V) / d
+    X = X.reshape(V, V)
+    return X + X.T
+
+def train(X, vector_size=16, iterations=1000, x_max=10, alpha=0.75, eta=0.05, seed=0):
+    ''' Fits the GloVe word and context vectors (and biases) to the co-occurrence matrix X
+    with full-batch AdaGrad. Returns the sum of the word and context vectors (GloVe's -model 2) '''
+    rng = np.random.RandomState(seed)
+    V = X.shape[0]
+    # Only the nonzero co-occurrences contribute to the cost
+    weight = np.minimum((X / x_max) ** alpha, 1.0)
+    log_X = np.log(np.where(X > 0, X, 1.0))
+
+    # Parameters and sums of squared gradients initialised as in GloVe
+    W = (rng.rand(2, V, vector_size) - 0.5) / vector_size
+    b = (rng.rand(2, V) - 0.5) / vector_size
+    gradsq_W = np.ones_like(W)
+    gradsq_b = np.ones_like(b)
+    for it in range(iterations):
+        diff = W[0] @ W[1].T + b[0][:, None] + b[1][None, :] - log_X
+        fdiff = weight * diff
+        grad_W = np.stack([fdiff @ W[1], fdiff.T @ W[0]])
+        grad_b = np.stack([fdiff.sum(axis=1), fdiff.sum(axis=0)])
+        W -= eta * grad_W / np.sqrt(gradsq_W)
+        b -= eta * grad_b / np.sqrt(gradsq_b)
+        gradsq_W += grad_W ** 2
+        gradsq_b += grad_b ** 2
+        if (it+1) % 100 == 0:
+            logging.debug(f"GloVe iteration {it+1}, cost {0.5 * np.sum(fdiff * diff) / np.count_nonzero(X):.6f}")
+    return W[0] + W[1]
+
+def save_vectors(filename, vocab, vectors):
+    ''' Writes the vectors in the text format of GloVe, including the <unk> vector
+    (the average of the vectors of the (at most 100) rarest words) '''
+    unk = vectors[-100:].mean(axis=0)
+    with open(filename, 'w') as f:
+        for word, vector in zip(vocab + ["<unk>"], list(vectors) + [unk]):
+            f.write(word + " " + " ".join(f"{v:.6f}" for v in vector) + "\n")
+
+def load_messages(filename):
+    with open(filename, 'r') as f:
+        return [line.split() for line in f]
+
+def main(args):
+    start = time.perf_counter()
+    messages = load_messages(args.corpus)
+    vocab = build_vocab(messages, args.vocab_min_count)
+    X = cooccurrence_matrix(messages, vocab, args.window_size)
+    vectors = train(X, args.vector_size, args.iterations, args.x_max, seed=args.seed)
+    os.makedirs(args.output, exist_ok=True)
+    save_vectors(os.path.join(args.output, f"vectors{args.name}.txt"), vocab, vectors)
+    print(f"Trained GloVe vectors for {len(vocab)} words in {time.perf_counter()-start:.3f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', type=str, required=True, help="Path to the corpus with one message per line.")
+    parser.add_argument('--output', type=str, required=True, help="Directory for the vectors.")
+    parser.add_argument('--name', type=str, required=True, help="Name of the vectors; they are written to <output>/vectors<name>.txt.")
+    parser.add_argument('--vocab_min_count', type=int, default=5, help="Minimum count of the words in the vocabulary.")
+    parser.add_argument('--vector_size', type=int, default=16, help="Dimension of the word vectors.")
+    parser.add_argument('--window_size', type=int, default=15, help="Number of context words on each side.")
+    parser.add_argument('--iterations', type=int, default=1000, help="Number of (full-batch) AdaGrad iterations.")
+    parser.add_argument('--x_max', type=float, default=10, help="Cutoff of the weighting function.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the initialisation of the vectors.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,191 @@
+import os
+import subprocess
+import sys
+import tempfile
+import logging
+import analysis
+import bmm_labels2grammar
+import bmm_update
+import convert2constituents
+import glove
+import instrument
+
+'''
+Python API for the two-stage grammar induction of scripts/run_induce_grammar.sh:
+constituency parsing (CCL or DIORA), labelling with BMM, conversion to an NLTK PCFG
+and (optionally) the analysis of the grammar, in one process.
+Only the external programs (cclparser, the DIORA scripts and BMM.jar) are run as separate processes
+and only their inputs and outputs are written to (temporary) files.
+
+A grammar can be updated with new messages (e.g. of a later snapshot of the agents) without
+running BMM on all messages again, see update_grammar and bmm_update.py.
+
+Example usage (from utils/ or with utils/ on the Python path):
+    from induce import induce_grammar, update_grammar
+    grammar, results = induce_grammar(messages, parser='ccl', eval_messages=eval_messages, L=10)
+    grammar = update_grammar(grammar, len(messages), new_messages, parser='ccl')
+'''
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CCL_PARSER = os.path.join(REPO, 'pipeline', 'ccl', 'cclparser')
+BMM_JAR = os.path.join(REPO, 'pipeline', 'bmm', 'BMM.jar')
+DIORA_DIR = os.path.join(REPO, 'pipeline', 'diora')
+
+def to_messages(messages):
+    ''' Returns the messages (strings or sequences of words) as tuples of words '''
+    return [tuple(m.split()) if isinstance(m, str) else tuple(m) for m in messages]
+
+def run_ccl(messages, work_dir, name='language', ccl_parser=CCL_PARSER, log_dir=None):
+    ''' Learns and parses the messages with the CCL parser.
+    Returns the path to the bracket file '''
+    corpus = os.path.join(work_dir, "corpus.txt")
+    with open(corpus, 'w') as f:
+        f.write("\n".join(" ".join(m) for m in messages) + "\n")
+    exec_file = os.path.join(work_dir, "exec_file")
+    with open(exec_file, 'w') as f:
+        f.write(f"{corpus} line learn\n")
+        f.write(f"{corpus} line parse -o {os.path.join(work_dir, name)} -s ccl\n")
+    with open(os.path.join(log_dir or work_dir, f"{name}_ccl.log"), 'w') as log:
+        subprocess.run([ccl_parser, exec_file], stdout=log, stderr=subprocess.STDOUT, check=True)
+    return os.path.join(work_dir, f"{name}.ccl")
+
+def run_diora(messages, work_dir, name='language', diora_dir=DIORA_DIR, cuda=True, threads=None,
+              epochs=5, batch_size=None, log_dir=None):
+    ''' Trains DIORA on the messages (with GloVe vectors of glove.py) and parses them with the trained model.
+    With cuda (default), DIORA runs on all GPUs with batches of 128 messages; otherwise on the CPU with
+    threads threads (default: all cores) and batches of at most 1024 messages. The CPU path has not been
+    run against DIORA yet (its flags and parse.jsonl are unverified).
+    Returns the path to the parse trees (parse.jsonl) '''
+    corpus = os.path.join(work_dir, "corpus.txt")
+    with open(corpus, 'w') as f:
+        f.write("\n".join(" ".join(m) for m in messages) + "\n")
+    vocab = glove.build_vocab(messages)
+    vectors = os.path.join(work_dir, f"vectors{name}.txt")
+    glove.save_vectors(vectors, vocab, glove.train(glove.cooccurrence_matrix(messages, vocab)))
+
+    batch_size = batch_size or min(len(messages), 128 if cuda else 1024)
+    device = ['--cuda', '--multigpu'] if cuda else []
+    pytorch_dir = os.path.join(diora_dir, 'pytorch')
+    threads = str(threads or os.cpu_count())
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([pytorch_dir, os.environ.get('PYTHONPATH', '')]))
+    if not cuda:
+        env.update(OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads)
+    train = [sys.executable, 'diora/scripts/train.py', '--data_type', 'txt', '--emb', 'w2v', '--embeddings_path', vectors,
+             '--train_path', corpus, '--validation_path', corpus, '--save_latest', '1', '--save_after', '0',
+             '--experiment_path', work_dir, '--max_epoch', str(epochs), '--batch_size', str(batch_size),
+             '--log_every_batch', '1'] + device
+    parse = [sys.executable, 'diora/scripts/parse.py', '--data_type', 'txt', '--embeddings_path', vectors,
+             '--load_model_path', os.path.join(work_dir, 'model_periodic.pt'), '--batch_size', str(batch_size),
+             '--validation_path', corpus, '--experiment_path', work_dir] + device
+    with open(os.path.join(log_dir or work_dir, f"{name}_diora.log"), 'w') as log:
+        for command in [train, parse]:
+            subprocess.run(command, cwd=pytorch_dir, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+    return os.path.join(work_dir, "parse.jsonl")
+
+def run_bmm(lines, spans, work_dir, name='language', bmm_jar=BMM_JAR, log_dir=None):
+    ''' Labels the constituents (spans) of the messages (lines) with BMM.
+    Returns the path to the induced grammar '''
+    os.makedirs(os.path.join(work_dir, "Output"), exist_ok=True)
+    with open(os.path.join(work_dir, f"{name}.txt"), 'w') as f:
+        f.write("\n".join(lines))
+    with open(os.path.join(work_dir, f"{name}.span"), 'w') as f:
+        f.write("\n".join(spans))
+    with open(os.path.join(log_dir or work_dir, f"{name}_bmm.log"), 'w') as log:
+        subprocess.run(['java', '-jar', '-Xmx4096m', '-Xms2048m', os.path.abspath(bmm_jar), f"{name}.txt", f"{name}.span"],
+                       cwd=work_dir, stdout=log, stderr=subprocess.STDOUT, check=True)
+    return os.path.join(work_dir, "Output", "Induced_Grammar.txt")
+
+def run_parser(messages, parser, work_dir, name='language', cuda=True, threads=None, log_dir=None,
+               ccl_parser=CCL_PARSER, diora_dir=DIORA_DIR):
+    ''' Induces the constituency structure of the messages with the parser ('ccl' or 'diora').
+    Returns the path to the bracket file '''
+    if parser == 'ccl':
+        logging.info("Running the CCL parser")
+        with instrument.stage('ccl', messages=len(messages)):
+            return run_ccl(messages, work_dir, name, ccl_parser, log_dir)
+    logging.info("Training and parsing with DIORA")
+    with instrument.stage('diora', messages=len(messages), cuda=cuda):
+        return run_diora(messages, work_dir, name, diora_dir, cuda, threads, log_dir=log_dir)
+
+def induce_grammar(messages, parser='ccl', eval_messages=None, bracket_file=None, analyse=True,
+                   L=None, overgeneration=0, beam_width=None, beam_threshold=None,
+                   cuda=True, threads=None, name='language', work_dir=None, log_dir=None,
+                   ccl_parser=CCL_PARSER, bmm_jar=BMM_JAR, diora_dir=DIORA_DIR):
+    '''
+    Induces a PCFG (with start symbol TOP) from the messages (strings or sequences of words).
+    The constituency structure is induced by the parser ('ccl' or 'diora') and labelled by BMM.
+    DIORA is trained on the GPUs, or on the CPU if cuda is False (see run_diora).
+    A given bracket_file (CCL output or DIORA's parse.jsonl) skips running the parser.
+    The intermediate files are written to work_dir (default: a temporary directory).
+
+    If analyse is set, the grammar is evaluated on the messages and eval_messages (default: messages),
+    see analysis.analyse for the other arguments.
+    Returns the grammar and the dictionary with the metrics (or None).
+    '''
+    if parser not in ['ccl', 'diora']:
+        raise ValueError(f"Unknown constituency parser {parser!r}; options are 'ccl' and 'diora'")
+    messages = to_messages(messages)
+    eval_messages = messages if eval_messages is None else to_messages(eval_messages)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = work_dir or tmp_dir
+        if bracket_file is None:
+            bracket_file = run_parser(messages, parser, work_dir, name, cuda, threads, log_dir, ccl_parser, diora_dir)
+
+        # Convert the constituency trees to the spans read by BMM
+        with instrument.stage('convert_trees', format=parser) as record:
+            if parser == 'ccl':
+                trees = convert2constituents.parse2list_ccl(bracket_file, True)
+                lines = [" ".join(m) + " ." for m in messages]
+            else:
+                trees = convert2constituents.parse2list_diora(bracket_file, True)
+                lines = convert2constituents.parse2text_diora(bracket_file)
+            spans = [convert2constituents.remove_redundant_brackets(span)
+                     for _, span in convert2constituents.convert_trees(trees, True)]
+            record['messages'] = len(trees)
+        if len(lines) != len(spans):
+            raise ValueError(f"The bracket file {bracket_file} has {len(spans)} trees for {len(lines)} messages")
+
+        logging.info("Running BMM")
+        with instrument.stage('bmm', messages=len(lines)):
+            bmm_file = run_bmm(lines, spans, work_dir, name, bmm_jar, log_dir)
+
+        with instrument.stage('pcfg_fromstring') as record:
+            grammar = bmm_labels2grammar.pcfg_fromstring(bmm_labels2grammar.parse_induced_grammar(bmm_file))
+            record['rules'] = len(grammar.productions())
+
+    if not analyse:
+        return grammar, None
+    results = analysis.analyse(grammar, messages, eval_messages, L=L, overgeneration=overgeneration,
+                               beam_width=beam_width, beam_threshold=beam_threshold)
+    return grammar, results
+
+def update_grammar(grammar, induced_messages, messages, parser='ccl', bracket_file=None, prior_weight=1.0, decay=1.0,
+                   cuda=True, threads=None, name='language', work_dir=None, log_dir=None,
+                   ccl_parser=CCL_PARSER, diora_dir=DIORA_DIR):
+    '''
+    Updates a PCFG induced from induced_messages messages (the number) with the new messages,
+    without running BMM: the new messages are parsed by the parser ('ccl' or 'diora', or read from
+    a given bracket_file) and their constituents labelled with the nonterminals of the grammar, see
+    bmm_update.update_grammar for prior_weight and decay. Returns the updated grammar.
+    '''
+    if parser not in ['ccl', 'diora']:
+        raise ValueError(f"Unknown constituency parser {parser!r}; options are 'ccl' and 'diora'")
+    messages = to_messages(messages)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = work_dir or tmp_dir
+        if bracket_file is None:
+            bracket_file = run_parser(messages, parser, work_dir, name, cuda, threads, log_dir, ccl_parser, diora_dir)
+        with instrument.stage('convert_trees', format=parser) as record:
+            trees = bmm_update.read_trees(bracket_file, parser)
+            record['messages'] = len(trees)
+        if len(trees) != len(messages):
+            raise ValueError(f"The bracket file {bracket_file} has {len(trees)} trees for {len(messages)} messages")
+
+    grammar_string = "\n".join(str(production) for production in grammar.productions())
+    grammar_string = bmm_update.update_grammar(grammar_string, induced_messages, trees, prior_weight, decay)
+    with instrument.stage('pcfg_fromstring') as record:
+        grammar = bmm_labels2grammar.pcfg_fromstring(grammar_string)
+        record['rules'] = len(grammar.productions())
+    return grammar
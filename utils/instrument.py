@@ -0,0 +1,137 @@
+import cProfile
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+'''
+Instrumentation of the stages of the pipeline scripts.
+Each stage records its wall time, CPU time, peak memory and item counts
+(e.g. messages parsed, chart cells filled, rules) and, if a trace is started,
+appends them as one JSON line to the trace file (e.g. logs/<timestamp>/trace.jsonl).
+
+Long loops report their progress (rate, ETA and coverage) with Progress.
+
+Example usage:
+    instrument.start_trace("logs/trace.jsonl", script="analysis", name="V6L3s0")
+    with instrument.stage("viterbi_eval") as record:
+        results = analyse_viterbi(grammar, messages)
+        record['messages'] = len(messages)
+'''
+
+_trace = {'path': None, 'context': {}, 'profiler': None, 'profile_dir': None}
+
+PROGRESS_INTERVAL = 10 # minimum number of seconds between two progress reports
+
+def start_trace(path, profiler=None, **context):
+    ''' Appends the records of all following stages to the JSON-lines file at path.
+    The context (e.g. script and language name) is added to each record.
+    If profiler ('cprofile' or 'pyinstrument') is set, the stages wrapped in profile()
+    are profiled and the profiles are written next to the trace file. '''
+    _trace['path'] = path
+    _trace['context'] = context
+    _trace['profiler'] = profiler
+    _trace['profile_dir'] = os.path.dirname(path) if path else None
+
+def peak_rss_kb():
+    ''' Peak resident set size of this process so far in kB '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+@contextmanager
+def stage(name, **counts):
+    ''' Measures the stage in the with block; the yielded record (a dictionary)
+    can be updated with item counts inside the block '''
+    record = {'stage': name}
+    record.update(counts)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    yield record
+    record['wall_s'] = time.perf_counter() - wall
+    record['cpu_s'] = time.process_time() - cpu
+    record['peak_rss_kb'] = peak_rss_kb()
+    logging.debug(f"Stage {name}: {record['wall_s']:.3f}s wall, {record['cpu_s']:.3f}s CPU")
+    if _trace['path']:
+        record = dict(_trace['context'], time=datetime.now().isoformat(), **record)
+        with open(_trace['path'], 'a') as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+@contextmanager
+def profile(name):
+    ''' Profiles the with block if a profiler is set in start_trace;
+    cProfile writes <name>.prof (e.g. for snakeviz) and pyinstrument writes <name>.html '''
+    profiler = _trace['profiler']
+    name = "_".join(str(v) for v in _trace['context'].values()) + f"_{name}"
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        p = Profiler()
+        p.start()
+        yield
+        p.stop()
+        with open(os.path.join(_trace['profile_dir'] or '.', name + ".html"), 'w') as f:
+            f.write(p.output_html())
+    elif profiler == 'cprofile':
+        p = cProfile.Profile()
+        p.enable()
+        yield
+        p.disable()
+        p.dump_stats(os.path.join(_trace['profile_dir'] or '.', name + ".prof"))
+    else:
+        yield
+
+class Progress:
+    ''' Reports the progress of a loop over total items to the log, at most once every interval seconds:
+    the number of items done, the rate (items/s), the estimated time remaining and
+    the running coverage (% of the items done that succeeded, e.g. that could be parsed).
+
+    Example usage:
+        progress = instrument.Progress("Overgeneration", num_samples)
+        for message in messages:
+            progress.update(success=parse(message))
+        progress.finish()
+    '''
+
+    def __init__(self, name, total, unit="messages", interval=None):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.interval = PROGRESS_INTERVAL if interval is None else interval
+        self.done = 0
+        self.success = 0
+        self.start = time.perf_counter()
+        self._last = self.start
+        self._reported = None
+
+    def update(self, n=1, success=0):
+        ''' Adds n items done of which success succeeded; only reports if interval seconds have passed '''
+        self.done += n
+        self.success += success
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report(now)
+
+    def report(self, now=None):
+        self._reported = self.done
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else float('inf')
+        coverage = self.success / self.done * 100 if self.done else 0.0
+        logging.info(f"{self.name}: {self.done}/{self.total} {self.unit} ({self.done/max(self.total, 1)*100:.1f}%), "
+                     f"{rate:.1f} {self.unit}/s, ETA {_format_seconds(eta)}, coverage {coverage:.2f}%")
+
+    def finish(self):
+        ''' Reports the final counts, unless they were just reported '''
+        if self._reported != self.done:
+            self.report()
+
+def _format_seconds(seconds):
+    if seconds == float('inf'):
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
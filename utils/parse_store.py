@@ -0,0 +1,181 @@
+import os
+import numpy as np
+
+'''
+Compact store of the Viterbi parses of a set of messages in (numpy) arrays:
+per message its id (line in the message file), log2 probability and tree depth
+(NaN and -1 if the message cannot be parsed), and its tree as a list of nodes
+in preorder, each with a label (index in the symbols of the store) and a pointer
+to its parent (index in the nodes of the tree, -1 for the root), in the smallest integer type.
+The leaves of a tree are its words.
+NLTK is only imported for converting trees, such that loading a store does not need it.
+The nodes of message row i are nodes offsets[i]:offsets[i+1] of labels and parents.
+For many messages, ParseStoreWriter(directory=...) keeps the parses in files instead of memory.
+
+Example usage:
+    writer = ParseStoreWriter()
+    writer.add(0, tree, depth=tree_depth(tree), log2prob=tree.logprob()/np.log(2))
+    writer.add(1, None)
+    writer.to_store().save("V6L3s0_eval.parses.npz")
+
+    store = ParseStore.load("V6L3s0_eval.parses.npz")
+    tree = store.get(1)
+'''
+
+class ParseStore:
+    ''' Parses of a set of messages in arrays (see ParseStoreWriter for building a store) '''
+
+    def __init__(self, message_ids, log2probs, depths, offsets, labels, parents, symbols):
+        self.message_ids = message_ids
+        self.log2probs = log2probs
+        self.depths = depths
+        self.offsets = offsets
+        self.labels = labels
+        self.parents = parents
+        self.symbols = symbols
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            return cls(*(f[key] for key in ['message_ids', 'log2probs', 'depths', 'offsets', 'labels', 'parents', 'symbols']))
+
+    def save(self, filename):
+        np.savez(filename, message_ids=self.message_ids, log2probs=self.log2probs, depths=self.depths,
+                 offsets=self.offsets, labels=self.labels, parents=self.parents, symbols=self.symbols)
+
+    def __len__(self):
+        return len(self.message_ids)
+
+    @property
+    def parsed(self):
+        ''' Boolean mask of the messages that could be parsed '''
+        return self.offsets[1:] > self.offsets[:-1]
+
+    def find(self, message_id):
+        ''' Returns the row of the message with this id (the ids are increasing) '''
+        row = np.searchsorted(self.message_ids, message_id)
+        if row == len(self) or self.message_ids[row] != message_id:
+            raise KeyError(message_id)
+        return int(row)
+
+    def nodes(self, row):
+        ''' Returns the labels and parents of the nodes of the tree of a row '''
+        start, end = self.offsets[row], self.offsets[row+1]
+        return self.labels[start:end], self.parents[start:end]
+
+    def get(self, message_id):
+        ''' Returns the tree of the message with this id (see tree) '''
+        return self.tree(self.find(message_id))
+
+    def tree(self, row):
+        ''' Returns the tree of a row as an nltk Tree (or None if the message cannot be parsed) '''
+        from nltk import Tree
+        labels, parents = self.nodes(row)
+        if len(labels) == 0:
+            return None
+        children = [[] for _ in labels]
+        for node in range(len(labels)-1, 0, -1):
+            children[parents[node]].append(node)
+        nodes = [None] * len(labels)
+        for node in range(len(labels)-1, -1, -1):
+            symbol = str(self.symbols[labels[node]])
+            nodes[node] = Tree(symbol, [nodes[c] for c in reversed(children[node])]) if children[node] else symbol
+        return nodes[0]
+
+
+class ParseStoreWriter:
+    ''' Collects the parses of messages (in increasing order of their ids) for a ParseStore.
+    Every flush_size nodes (or messages) the parses collected so far are converted to arrays;
+    if a directory is given, these are appended to files in the directory instead of kept in memory,
+    such that the memory stays bounded, and the store of to_store is memory-mapped from the directory. '''
+
+    COLUMNS = [('message_ids', np.int64), ('log2probs', np.float64), ('depths', np.int16),
+               ('sizes', np.int64), ('labels', np.int32), ('parents', np.int32)]
+
+    def __init__(self, flush_size=1000000, directory=None):
+        self.flush_size = flush_size
+        self.directory = directory
+        self.symbol_index = {}
+        self.max_size = 0
+        self.columns = {name: [] for name, _ in self.COLUMNS}
+        # Columns already converted to arrays (if not written to the directory), such that the lists stay small
+        self.arrays = {name: [] for name, _ in self.COLUMNS}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for name, _ in self.COLUMNS:
+                open(self._path(name), 'wb').close()
+
+    def _path(self, name, extension='bin'):
+        return os.path.join(self.directory, f"{name}.{extension}")
+
+    def _symbol(self, symbol):
+        return self.symbol_index.setdefault(str(symbol), len(self.symbol_index))
+
+    def add(self, message_id, tree, depth=-1, log2prob=float('nan')):
+        ''' Adds the parse tree (an nltk Tree or None if the message cannot be parsed) of a message '''
+        from nltk import Tree
+        labels, parents = self.columns['labels'], self.columns['parents']
+        self.columns['message_ids'].append(message_id)
+        self.columns['log2probs'].append(np.nan if tree is None else log2prob)
+        self.columns['depths'].append(-1 if tree is None else depth)
+        size = 0
+        if tree is not None:
+            stack = [(tree, -1)]
+            while stack:
+                node, parent = stack.pop()
+                index = size
+                size += 1
+                if isinstance(node, Tree):
+                    labels.append(self._symbol(node.label()))
+                    stack.extend((child, index) for child in reversed(node))
+                else:
+                    labels.append(self._symbol(node))
+                parents.append(parent)
+        self.columns['sizes'].append(size)
+        self.max_size = max(self.max_size, size)
+        if len(labels) >= self.flush_size or len(self.columns['sizes']) >= self.flush_size:
+            self._flush()
+
+    def _flush(self):
+        for name, dtype in self.COLUMNS:
+            array = np.array(self.columns[name], dtype=dtype)
+            self.columns[name] = []
+            if self.directory is None:
+                self.arrays[name].append(array)
+            else:
+                with open(self._path(name), 'ab') as f:
+                    array.tofile(f)
+
+    def _column(self, name, dtype):
+        if self.directory is None:
+            return np.concatenate(self.arrays[name])
+        if os.path.getsize(self._path(name)) == 0: # cannot be memory-mapped
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._path(name), dtype=dtype, mode='r')
+
+    def _allocate(self, name, dtype, length):
+        if self.directory is None:
+            return np.empty(length, dtype=dtype)
+        return np.lib.format.open_memmap(self._path(name, 'npy'), mode='w+', dtype=dtype, shape=(length,))
+
+    def to_store(self):
+        self._flush()
+        columns = {name: self._column(name, dtype) for name, dtype in self.COLUMNS}
+        offsets = self._allocate('offsets', np.int64, len(columns['sizes']) + 1)
+        offsets[0] = 0
+        np.cumsum(columns['sizes'], out=offsets[1:])
+        return ParseStore(columns['message_ids'],
+                          columns['log2probs'],
+                          columns['depths'],
+                          offsets,
+                          self._smallest('labels', columns['labels'], len(self.symbol_index)),
+                          self._smallest('parents', columns['parents'], self.max_size),
+                          np.array(list(self.symbol_index), dtype=str))
+
+    def _smallest(self, name, array, max_value, chunk_size=1000000):
+        ''' Returns the (signed) integer array in the smallest dtype that holds max_value '''
+        dtype = next((dtype for dtype in [np.int8, np.int16, np.int32] if max_value <= np.iinfo(dtype).max), np.int64)
+        result = self._allocate(name, dtype, len(array))
+        for start in range(0, len(array), chunk_size):
+            result[start:start+chunk_size] = array[start:start+chunk_size]
+        return result
@@ -0,0 +1,157 @@
+import argparse
+import logging
+import time
+import numpy as np
+from cky import CompiledGrammar
+from analysis import read_grammar, load_messages
+
+'''
+Ancestral sampler for the induced PCFGs, which draws messages with their probabilities
+(unlike nltk's generate, which enumerates the derivations and ignores the probabilities).
+A batch of derivations is expanded top-down as one flat array of symbols (the frontiers of
+all derivations concatenated in order): in each step every nonterminal draws a rule at once
+and is replaced by its children. Derivations longer than max_length words (or not finished
+after max_steps steps) are rejected, such that the messages are drawn from the grammar
+conditioned on their length.
+
+Example usage:
+    python utils/sampler.py --grammar results/grammars/ccl/V6L3s0.pcfg -n 1000000 --max_length 10 --output samples.txt --full data/V6L3s0_full.txt
+'''
+
+class PCFGSampler:
+    '''
+    Samples messages from a (compiled) PCFG, reproducibly for a given seed.
+    The rules of each symbol of the CompiledGrammar (binary, unary and lexical) are stored
+    with their children (terminal t as -(t+1)) in arrays sorted by lhs, where the cumulative
+    probability of rule r within its lhs plus the lhs id is key[r], such that a rule of lhs
+    is drawn by searching lhs + u (u uniform in [0, 1)) in the keys.
+    '''
+
+    def __init__(self, grammar, seed=0):
+        g = grammar if isinstance(grammar, CompiledGrammar) else CompiledGrammar(grammar)
+        self.compiled = g
+        self.rng = np.random.RandomState(seed)
+        terminals = g.lexicon.entry_terminals()
+        lhs = np.concatenate([g.binary_lhs, g.unary_lhs, g.lexicon.preterminals])
+        children = np.full((len(lhs), 2), np.iinfo(np.intp).min, dtype=np.intp)
+        children[:len(g.binary_lhs), 0] = g.binary_left
+        children[:len(g.binary_lhs), 1] = g.binary_right
+        children[len(g.binary_lhs):len(g.binary_lhs)+len(g.unary_lhs), 0] = g.unary_child
+        children[len(g.binary_lhs)+len(g.unary_lhs):, 0] = -terminals - 1
+        logprob = np.concatenate([g.binary_logprob, g.unary_logprob, g.lexicon.logprobs])
+
+        order = np.argsort(lhs, kind='stable')
+        self.lhs, self.children, self.logprob = lhs[order], children[order], logprob[order]
+        self.arity = (self.children != np.iinfo(np.intp).min).sum(axis=1)
+        prob = np.exp2(self.logprob)
+        starts = np.searchsorted(self.lhs, np.arange(g.nonterminal_count + 1))
+        totals = np.bincount(self.lhs, weights=prob, minlength=g.nonterminal_count)
+        # Symbols without rules (or probability mass) cannot be expanded
+        self.expandable = totals > 0
+        within = np.cumsum(prob) - np.repeat(np.r_[0, np.cumsum(prob)][starts[:-1]], np.diff(starts))
+        self.key = self.lhs + within / np.where(self.expandable, totals, 1)[self.lhs]
+        self.ends = starts[1:]
+
+    def _draw(self, symbols):
+        ''' Draws a rule for each (expandable) symbol '''
+        rules = np.searchsorted(self.key, symbols + self.rng.random_sample(len(symbols)), side='right')
+        # Rounding may give the first rule of the next symbol
+        return np.minimum(rules, self.ends[symbols] - 1)
+
+    def sample_batch(self, size, max_length, min_length=1, max_steps=1000):
+        '''
+        Expands size derivations from the start symbol. Returns the terminal ids of the accepted messages
+        as a flat array, the offsets of each message in it and the log2 probability of each derivation.
+        '''
+        g = self.compiled
+        symbols = np.full(size, g.start_index, dtype=np.intp) # frontier; terminal t as -(t+1)
+        owner = np.arange(size) # derivation of each frontier symbol
+        logprob = np.zeros(size)
+        alive = np.ones(size, dtype=bool)
+        for _ in range(max_steps):
+            open_ = symbols >= 0
+            if not open_.any():
+                break
+            # Reject the derivations that are too long or cannot be completed
+            dead = np.zeros(size, dtype=bool)
+            dead[owner[open_][~self.expandable[symbols[open_]]]] = True
+            dead |= np.bincount(owner, minlength=size) > max_length
+            if dead.any():
+                alive &= ~dead
+                keep = alive[owner]
+                symbols, owner, open_ = symbols[keep], owner[keep], open_[keep]
+                if not open_.any():
+                    break
+
+            rules = self._draw(symbols[open_])
+            np.add.at(logprob, owner[open_], self.logprob[rules])
+            # Replace each nonterminal by the children of its rule, in order
+            counts = np.ones(len(symbols), dtype=np.intp)
+            counts[open_] = self.arity[rules]
+            rule_of = np.full(len(symbols), -1, dtype=np.intp)
+            rule_of[open_] = rules
+            parent = np.repeat(np.arange(len(symbols)), counts)
+            child = np.arange(len(parent)) - np.repeat(np.cumsum(counts) - counts, counts)
+            expanded = rule_of[parent] >= 0
+            symbols = np.where(expanded, self.children[np.maximum(rule_of[parent], 0), child], symbols[parent])
+            owner = owner[parent]
+        else:
+            alive[owner[symbols >= 0]] = False
+
+        lengths = np.bincount(owner, minlength=size)
+        alive &= (lengths >= min_length) & (lengths <= max_length)
+        keep = alive[owner]
+        offsets = np.zeros(alive.sum() + 1, dtype=np.intp)
+        np.cumsum(lengths[alive], out=offsets[1:])
+        return -symbols[keep] - 1, offsets, logprob[alive]
+
+    def sample(self, n, max_length, min_length=1, batch_size=100000, max_steps=1000):
+        '''
+        Returns n messages (tuples of words) of min_length to max_length words and the log2 probability
+        of the derivation of each message (the probability of the message itself may be larger, if
+        the grammar is ambiguous). Raises a ValueError if no message of such a length is drawn in a batch.
+        '''
+        messages = []
+        logprobs = []
+        terminals = np.array(self.compiled.terminals, dtype=object)
+        while len(messages) < n:
+            words, offsets, logprob = self.sample_batch(batch_size, max_length, min_length, max_steps)
+            if len(logprob) == 0:
+                raise ValueError(f"The grammar generated no message of {min_length} to {max_length} words in {batch_size} samples")
+            words = terminals[words]
+            take = min(len(logprob), n - len(messages))
+            messages.extend(tuple(words[offsets[i]:offsets[i+1]]) for i in range(take))
+            logprobs.append(logprob[:take])
+        return messages, np.concatenate(logprobs)
+
+def precision(samples, messages):
+    ''' Returns the percentage of the sampled messages that occur in the messages (e.g. the full set) '''
+    messages = set(messages)
+    return sum(m in messages for m in samples) / len(samples) * 100
+
+def main(args):
+    start = time.perf_counter()
+    sampler = PCFGSampler(read_grammar(args.grammar), args.seed)
+    samples, logprobs = sampler.sample(args.n, args.max_length, args.min_length, args.batch_size)
+    logging.info(f"Sampled {len(samples)} messages in {time.perf_counter()-start:.3f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            for message, logprob in zip(samples, logprobs):
+                f.write((f"{logprob}\t" if args.logprobs else "") + " ".join(message) + "\n")
+    print(f"Sampled {len(samples)} messages, average log2 probability {logprobs.mean():.4f}")
+    if args.full:
+        print(f"Precision (sampled messages in {args.full}): {precision(samples, load_messages(args.full)):.2f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grammar', type=str, required=True, help="Path to file containing a PCFG.")
+    parser.add_argument('-n', type=int, default=10000, help="Number of messages to sample.")
+    parser.add_argument('--max_length', type=int, required=True, help="Maximum number of words of a message (e.g. L).")
+    parser.add_argument('--min_length', type=int, default=1, help="Minimum number of words of a message.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    parser.add_argument('--batch_size', type=int, default=100000, help="Number of derivations expanded at once.")
+    parser.add_argument('--output', type=str, default=None, help="File for the sampled messages (one per line).")
+    parser.add_argument('--logprobs', action='store_true', help="Write the log2 probability of each message before it (tab separated).")
+    parser.add_argument('--full', type=str, default=None, help="Path to the full set of messages, to report the percentage of sampled messages in it.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,169 @@
+import argparse
+import json
+import numpy as np
+from parse_store import ParseStore
+
+'''
+Structural statistics of the Viterbi trees in a ParseStore (see parse_store.py):
+the number of unique trees (labelled by their nonterminals, not their words: tree diversity), rule usage, depth and branching distributions
+and the profile of the constituent spans.
+All statistics are computed on the node arrays of all trees at once; trees are compared by hashing
+and the recursive properties (depth, spans) by following the parent pointers for all nodes in parallel.
+
+Example usage:
+    python utils/tree_stats.py --parses logs/<timestamp>/V6L3s0_emergent_eval.parses.npz
+'''
+
+HASH_BASE = np.uint64(0x9E3779B97F4A7C15) # odd 64-bit multipliers for hashing
+HASH_LABEL = np.uint64(0xC2B2AE3D27D4EB4F)
+HASH_PARENT = np.uint64(0x165667B19E3779F9)
+
+class TreeArrays:
+    ''' The nodes of all trees in a ParseStore with their tree (row), global parent index,
+    number of children, rank among their siblings and depth (root: 0) '''
+
+    def __init__(self, store):
+        self.store = store
+        sizes = np.diff(store.offsets)
+        self.size = int(store.offsets[-1])
+        self.row = np.repeat(np.arange(len(store)), sizes)
+        self.local = np.arange(self.size) - store.offsets[self.row]
+        parents = store.parents.astype(np.int64)
+        self.parent = np.where(parents >= 0, parents + store.offsets[self.row], -1)
+        self.labels = store.labels.astype(np.int64)
+
+        child = np.nonzero(self.parent >= 0)[0]
+        self.n_children = np.bincount(self.parent[child], minlength=self.size)
+        self.is_leaf = self.n_children == 0
+        # Children follow their parent in preorder, so sorting them (stably) by parent gives the sibling order
+        order = child[np.argsort(self.parent[child], kind='stable')]
+        first = np.r_[True, self.parent[order][1:] != self.parent[order][:-1]]
+        group_start = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+        self.rank = np.zeros(self.size, dtype=np.int64)
+        self.rank[order] = np.arange(len(order)) - group_start
+
+        # Depth by following the parent pointers of all nodes at once
+        self.depth = np.zeros(self.size, dtype=np.int64)
+        ancestor = self.parent.copy()
+        while True:
+            active = ancestor >= 0
+            if not active.any():
+                break
+            self.depth[active] += 1
+            ancestor[active] = self.parent[ancestor[active]]
+
+    @property
+    def is_preterminal(self):
+        ''' Nodes with a single child that is a word '''
+        single = self.n_children == 1
+        pre = np.zeros(self.size, dtype=bool)
+        leaf_child = np.nonzero(self.is_leaf & (self.parent >= 0))[0]
+        pre[self.parent[leaf_child]] = True
+        return pre & single
+
+    def _reduce(self, ufunc, values, empty):
+        ''' Reduces the values of the nodes per tree (empty for unparsed messages) '''
+        result = np.full(len(self.store), empty, dtype=values.dtype)
+        parsed = self.store.parsed
+        if parsed.any():
+            result[parsed] = ufunc.reduceat(values, self.store.offsets[:-1][parsed])
+        return result
+
+    def tree_depths(self):
+        ''' Depth of each tree as analysis.tree_depth (the preterminals have depth 0), -1 if not parsed '''
+        return self._reduce(np.maximum, np.where(self.is_leaf, self.depth - 1, -1), -1)
+
+    def tree_hashes(self, nonterminals=True, words=False):
+        ''' 64-bit hash of each tree: of its structure, with the labels of the nonterminals if nonterminals
+        and the words (the labels of the leaves) if words '''
+        powers = np.cumprod(np.full(max(self.local.max(initial=0) + 1, 1), HASH_BASE, dtype=np.uint64)) # wraps around
+        value = (self.parent - np.where(self.parent >= 0, self.store.offsets[self.row], 0) + 2).astype(np.uint64) * HASH_PARENT
+        labelled = np.where(self.is_leaf, words, nonterminals)
+        value += np.where(labelled, self.labels + 1, 0).astype(np.uint64) * HASH_LABEL
+        return self._reduce(np.add, value * powers[self.local], np.uint64(0))
+
+    def rule_counts(self):
+        ''' Returns the rules used in the trees (lhs label followed by the child labels,
+        with -(label+1) for words) as an array and the number of times each rule is used '''
+        internal = np.nonzero(~self.is_leaf)[0]
+        position = np.full(self.size, -1)
+        position[internal] = np.arange(len(internal))
+        rules = np.full((len(internal), 1 + self.n_children.max(initial=0)), np.iinfo(np.int64).min)
+        rules[:, 0] = self.labels[internal]
+        child = np.nonzero(self.parent >= 0)[0]
+        rules[position[self.parent[child]], 1 + self.rank[child]] = np.where(self.is_leaf[child], -self.labels[child] - 1, self.labels[child])
+        # Rules are compared by hashing their rows
+        powers = np.cumprod(np.full(rules.shape[1], HASH_BASE, dtype=np.uint64))
+        hashes = (rules.astype(np.uint64) * powers).sum(axis=1, dtype=np.uint64)
+        _, index, counts = np.unique(hashes, return_index=True, return_counts=True)
+        return rules[index], counts
+
+    def spans(self):
+        ''' Returns the span (start, end) in words of each node '''
+        position = np.cumsum(self.is_leaf) - 1
+        position = position - np.r_[0, np.cumsum(self.is_leaf)][self.store.offsets[:-1]][self.row]
+        start = np.where(self.is_leaf, position, np.iinfo(np.int64).max)
+        end = np.where(self.is_leaf, position + 1, -1)
+        leaves = np.nonzero(self.is_leaf)[0]
+        ancestor = self.parent[leaves]
+        while True:
+            active = ancestor >= 0
+            if not active.any():
+                break
+            np.minimum.at(start, ancestor[active], position[leaves[active]])
+            np.maximum.at(end, ancestor[active], position[leaves[active]] + 1)
+            ancestor[active] = self.parent[ancestor[active]]
+        return start, end
+
+def rule_string(rule, symbols):
+    ''' Formats a rule of TreeArrays.rule_counts, e.g. A -> B '1' '''
+    rhs = [f"'{symbols[-c - 1]}'" if c < 0 else str(symbols[c]) for c in rule[1:] if c != np.iinfo(np.int64).min]
+    return f"{symbols[rule[0]]} -> {' '.join(rhs)}"
+
+def _histogram(values):
+    return {int(k): int(v) for k, v in zip(*np.unique(values, return_counts=True))}
+
+def structural_statistics(store, top_rules=None):
+    '''
+    Returns a dictionary with the structural statistics of the parsed trees in the store:
+    the number of (unique) trees and tree structures (i.e. bracketings) and the tree diversity
+    (unique trees / trees), where trees are compared by their structure and nonterminals but not their words
+    (the Viterbi parses of different messages would otherwise always differ), histograms of the tree depths and of the number of children of the
+    nonterminals, the usage of each rule (the top_rules most used if given), a histogram of
+    the constituent lengths and the fraction of trees with a constituent at each span (start-end),
+    where the constituents are the nonterminals other than the preterminals and the root.
+    '''
+    trees = TreeArrays(store)
+    parsed = store.parsed
+    n_trees = int(parsed.sum())
+    unique_trees = len(np.unique(trees.tree_hashes()[parsed]))
+    unique_structures = len(np.unique(trees.tree_hashes(nonterminals=False)[parsed]))
+
+    rules, counts = trees.rule_counts()
+    order = np.argsort(-counts, kind='stable')[:top_rules]
+    rule_usage = {rule_string(rules[i], store.symbols): int(counts[i]) for i in order}
+
+    start, end = trees.spans()
+    constituent = ~trees.is_leaf & ~trees.is_preterminal & (trees.parent >= 0)
+    width = int(end[constituent].max(initial=0)) + 1
+    spans, span_counts = np.unique(start[constituent] * width + end[constituent], return_counts=True)
+
+    return {
+        'trees': n_trees,
+        'unique_trees': unique_trees,
+        'unique_structures': unique_structures,
+        'tree_diversity': unique_trees / n_trees if n_trees else float('nan'),
+        'depth_histogram': _histogram(trees.tree_depths()[parsed]),
+        'branching_histogram': _histogram(trees.n_children[~trees.is_leaf & ~trees.is_preterminal]),
+        'rules_used': len(rules),
+        'rule_usage': rule_usage,
+        'constituent_length_histogram': _histogram((end - start)[constituent]),
+        'span_profile': {f"{span // width}-{span % width}": int(c) / n_trees for span, c in zip(spans.tolist(), span_counts)},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parses', type=str, required=True, help="Path to the parses (.parses.npz) saved by analysis.py --parse_store.")
+    parser.add_argument('--top_rules', type=int, default=20, help="Number of most used rules to show.")
+    args = parser.parse_args()
+    print(json.dumps(structural_statistics(ParseStore.load(args.parses), args.top_rules), indent=2))